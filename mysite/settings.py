@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os.path
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.middleware.RequestMetricsMiddleware',
+    'polls.middleware.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,16 +54,23 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'polls.middleware.QueryCheckMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'polls.metrics.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # templates are compiled once per process
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -84,6 +93,52 @@ DATABASES = {
     }
 }
 
+# 'production' keeps connections open between requests and tunes SQLite
+# with the pragmas below, applied to every new connection by polls.receivers
+DATABASE_PROFILE = config('DATABASE_PROFILE', cast=str,
+                          default='development')
+SQLITE_PRAGMAS = {}
+if DATABASE_PROFILE == 'production':
+    DATABASES['default']['CONN_MAX_AGE'] = config('CONN_MAX_AGE', cast=int,
+                                                  default=600)
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        # transactions wait for the write lock, see polls/backends
+        DATABASES['default']['ENGINE'] = 'polls.backends.sqlite3'
+    SQLITE_PRAGMAS = {
+        # readers no longer wait for a writer, nor the writer for readers
+        'journal_mode': 'WAL',
+        # fsync at checkpoints instead of every commit; safe with WAL
+        'synchronous': 'NORMAL',
+        'busy_timeout': config('SQLITE_BUSY_TIMEOUT_MS', cast=int,
+                               default=5000),
+        'mmap_size': config('SQLITE_MMAP_SIZE', cast=int,
+                            default=256 * 1024 * 1024),
+    }
+
+# Read replicas of the default database, one file or name per replica.
+# Reads go to them and writes to default, see polls/routers.py.
+DATABASE_REPLICAS = []
+for number, name in enumerate(config('REPLICA_DATABASE_NAMES', cast=Csv(),
+                                     default=''), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['polls.routers.ReadReplicaRouter']
+
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND', cast=str,
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', cast=str, default='ku-polls'),
+    }
+}
+
 AUTHENTICATION_BACKENDS = [
     # username/password authentication
     'django.contrib.auth.backends.ModelBackend',
@@ -130,3 +185,95 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = '/polls/'    # show list of polls
 LOGOUT_REDIRECT_URL = '/accounts/login/'
+
+# Record query count and timings per view, see polls/metrics.py
+POLLS_METRICS = config('POLLS_METRICS', cast=bool, default=False)
+
+# Report ('warn') or fail ('raise') requests that run the same SQL more
+# than the threshold times, see polls/querycheck.py
+POLLS_NPLUSONE = config('POLLS_NPLUSONE', cast=str, default='off')
+POLLS_NPLUSONE_THRESHOLD = config('POLLS_NPLUSONE_THRESHOLD', cast=int,
+                                  default=3)
+
+# Serve the index, detail and results pages with async views (for ASGI)
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', cast=bool, default=False)
+
+# Longest time the poll index stays cached, in seconds
+POLLS_INDEX_CACHE_TIMEOUT = config('POLLS_INDEX_CACHE_TIMEOUT', cast=int,
+                                   default=300)
+
+# Questions per index page, and the most a ?page_size= may ask for
+POLLS_INDEX_PAGE_SIZE = config('POLLS_INDEX_PAGE_SIZE', cast=int, default=5)
+POLLS_INDEX_MAX_PAGE_SIZE = config('POLLS_INDEX_MAX_PAGE_SIZE', cast=int,
+                                   default=50)
+
+# Search: 'auto' uses SQLite FTS5 when the database has it and SearchTerm
+# rows otherwise; 'terms' always uses SearchTerm rows. Run
+# rebuild_search_index after changing it.
+POLLS_SEARCH_BACKEND = config('POLLS_SEARCH_BACKEND', cast=str,
+                              default='auto')
+POLLS_SEARCH_PAGE_SIZE = config('POLLS_SEARCH_PAGE_SIZE', cast=int,
+                                default=20)
+
+# Results cache: how long entries live, and how many seconds old results
+# may be served after new votes (0 always serves the latest tallies)
+POLLS_RESULTS_CACHE_TIMEOUT = config('POLLS_RESULTS_CACHE_TIMEOUT', cast=int,
+                                     default=600)
+POLLS_RESULTS_STALENESS = config('POLLS_RESULTS_STALENESS', cast=int,
+                                 default=0)
+
+# How long the choice list and results table fragments of the question
+# pages stay cached, in seconds (0 turns fragment caching off)
+POLLS_FRAGMENT_CACHE_TIMEOUT = config('POLLS_FRAGMENT_CACHE_TIMEOUT',
+                                      cast=int, default=600)
+
+# How long browsers and shared caches may keep the results page of a
+# closed poll, in seconds
+POLLS_CLOSED_RESULTS_MAX_AGE = config('POLLS_CLOSED_RESULTS_MAX_AGE',
+                                      cast=int, default=86400)
+
+# Live results on the results page of open polls. Each viewer holds a
+# connection for up to POLLS_STREAM_DURATION, and under WSGI a worker
+# thread with it, so turn it on with async views on an ASGI server
+POLLS_RESULTS_STREAM = config('POLLS_RESULTS_STREAM', cast=bool,
+                              default=False)
+
+# Live results stream: at most one update per interval, a keep-alive
+# comment after heartbeat quiet seconds, and reconnects after duration
+POLLS_STREAM_INTERVAL = config('POLLS_STREAM_INTERVAL', cast=float,
+                               default=1.0)
+POLLS_STREAM_HEARTBEAT = config('POLLS_STREAM_HEARTBEAT', cast=float,
+                                default=15.0)
+POLLS_STREAM_DURATION = config('POLLS_STREAM_DURATION', cast=float,
+                               default=300.0)
+POLLS_STREAM_RETRY_MS = config('POLLS_STREAM_RETRY_MS', cast=int,
+                               default=3000)
+
+# Batch results API: the most question ids one request may ask for, and
+# how many are read (with a fixed number of queries) and sent at a time
+POLLS_RESULTS_BATCH_MAX_IDS = config('POLLS_RESULTS_BATCH_MAX_IDS', cast=int,
+                                     default=1000)
+POLLS_RESULTS_BATCH_CHUNK = config('POLLS_RESULTS_BATCH_CHUNK', cast=int,
+                                   default=100)
+
+# Seconds a browser keeps reading from the primary database after it
+# writes, to cover the replication lag of the read replicas
+POLLS_REPLICA_STICKY_SECONDS = config('POLLS_REPLICA_STICKY_SECONDS',
+                                      cast=int, default=10)
+
+# Spread the tally of each choice over this many shard rows, so concurrent
+# votes for one choice update different rows; compact_tallies folds them
+# back (0 keeps every tally in Choice.vote_count)
+POLLS_TALLY_SHARDS = config('POLLS_TALLY_SHARDS', cast=int, default=0)
+
+# Buffered (write-behind) voting, see polls/buffer.py
+POLLS_VOTE_BUFFER = config('POLLS_VOTE_BUFFER', cast=bool, default=False)
+POLLS_VOTE_BUFFER_SIZE = config('POLLS_VOTE_BUFFER_SIZE', cast=int,
+                                default=500)
+POLLS_VOTE_BUFFER_INTERVAL = config('POLLS_VOTE_BUFFER_INTERVAL', cast=float,
+                                    default=2.0)
+POLLS_VOTE_BUFFER_DURABILITY = config('POLLS_VOTE_BUFFER_DURABILITY',
+                                      cast=str, default='memory')
+POLLS_VOTE_BUFFER_JOURNAL_DIR = config('POLLS_VOTE_BUFFER_JOURNAL_DIR',
+                                       cast=str,
+                                       default=str(BASE_DIR / 'vote-journal'))
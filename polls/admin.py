@@ -1,7 +1,74 @@
-
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
+
+from .analytics import turnout
+from .models import (CLOSED, HOUR, OPEN, UPCOMING, Question, Choice,
+                     VoteRollup)
+from .pagination import keyset_page
+from .search import search_filter
+
+CURSOR_VAR = 'before'
+
+
+class StateFilter(admin.SimpleListFilter):
+    title = 'state'
+    parameter_name = 'state'
+
+    def lookups(self, request, model_admin):
+        return [(UPCOMING, 'Upcoming'), (OPEN, 'Open'), (CLOSED, 'Closed')]
+
+    def queryset(self, request, queryset):
+        now = timezone.now()
+        if self.value() == UPCOMING:
+            return queryset.upcoming(now)
+        if self.value() == OPEN:
+            return queryset.open(now)
+        if self.value() == CLOSED:
+            return queryset.closed(now)
+        return queryset
+
+
+class KeysetChangeList(ChangeList):
+    """Change list that pages by (pub_date, id) instead of counting rows.
+
+    It keeps the numbered pages of the admin when sorted by a column.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
 
-from .models import Question, Choice
+    def get_results(self, request):
+        self.older_url = self.newest_url = None
+        if ORDER_VAR in self.params:
+            return super().get_results(request)
+        cursor = self.params.get(CURSOR_VAR)
+        try:
+            questions, next_cursor = keyset_page(self.queryset, cursor,
+                                                 self.list_per_page)
+        except ValueError:
+            raise IncorrectLookupParameters
+        if next_cursor:
+            self.older_url = self.get_query_string({CURSOR_VAR: next_cursor})
+        if cursor:
+            self.newest_url = self.get_query_string(remove=[CURSOR_VAR])
+        self.result_count = len(questions)
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = questions
+        self.can_show_all = False
+        self.multi_page = bool(cursor or next_cursor)
+        self.paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page)
 
 
 class ChoiceInline(admin.TabularInline):
@@ -16,13 +83,90 @@ class QuestionAdmin(admin.ModelAdmin):
          {'fields': ['pub_date'], 'classes': ['collapse']}),
         ('End Date information',
          {'fields': ['end_date'], 'classes': ['collapse']}),
+        ('Turnout', {'fields': ['turnout_link']}),
     ]
+    readonly_fields = ['turnout_link']
     inlines = [ChoiceInline]
     list_display = ('question_text', 'pub_date',
                     'was_published_recently', 'is_published', 'can_vote')
-    list_filter = ['pub_date', 'end_date']
+    list_filter = [StateFilter, 'pub_date', 'end_date']
     search_fields = ['question_text']
+    ordering = ['-pub_date', '-id']
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # the search index instead of LIKE '%term%' on question_text
+        if not search_term.strip():
+            return queryset, False
+        return search_filter(queryset, search_term), False
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/turnout/',
+                 self.admin_site.admin_view(self.turnout_view),
+                 name='polls_question_turnout'),
+            *super().get_urls(),
+        ]
+
+    @admin.display(description='Votes over time')
+    def turnout_link(self, question):
+        if question.pk is None:
+            return '-'
+        return format_html('<a href="{}">Chart</a>', reverse(
+            'admin:polls_question_turnout', args=(question.pk,)))
+
+    def turnout_view(self, request, object_id):
+        """Chart the votes of a question per bucket from its rollups."""
+        question = self.get_object(request, object_id)
+        if question is None:
+            raise Http404
+        if not self.has_view_permission(request, question):
+            raise PermissionDenied
+        period = request.GET.get('period', HOUR)
+        if period not in dict(VoteRollup.PERIODS):
+            period = HOUR
+        choices = dict(question.choice_set.values_list('id', 'choice_text'))
+        series = turnout(question, period)
+        highest = max((total for _, total, _ in series), default=0)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Votes over time: {question}',
+            'question': question,
+            'period': period,
+            'periods': VoteRollup.PERIODS,
+            'rows': [
+                {'start': start, 'total': total,
+                 'width': total * 100 / highest if highest else 0,
+                 'choices': [(choices.get(choice_id), votes) for
+                             choice_id, votes in sorted(votes.items())]}
+                for start, total, votes in series],
+        }
+        return TemplateResponse(
+            request, 'admin/polls/question/turnout.html', context)
+
+
+class VoteRollupAdmin(admin.ModelAdmin):
+    list_display = ('start', 'period', 'question', 'choice', 'votes')
+    list_filter = ['period']
+    list_select_related = ['question', 'choice']
+    ordering = ['-start']
+    show_full_result_count = False
+
+    # rollups are written by rollup_votes only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(Choice)
+admin.site.register(VoteRollup, VoteRollupAdmin)
@@ -0,0 +1,209 @@
+"""Turnout over time: the votes of each choice per minute, hour and day.
+
+A rollup bucket counts the votes cast in it by the choice they stand for
+now. Buckets are stored as VoteRollup rows, so charts read one row per
+choice and bucket instead of every vote. update_rollups() brings them up
+to date incrementally: only the buckets holding votes cast or changed
+since the last run are counted again, with one grouped query per question
+and period. Counting a bucket again is idempotent, so runs may overlap.
+
+Votes recorded before Vote.cast_at existed have no time and are left out.
+Deleting votes (with their user), importing votes cast before the last
+run, or moving votes without setting changed_at does not mark their
+buckets; run update_rollups(full=True) afterwards.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Substr, TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+from .models import (DAY, HOUR, MINUTE, ArchivedVote, Vote, VoteRollup,
+                     VoteRollupState)
+from .routers import pin_primary
+
+TRUNCATE = {MINUTE: TruncMinute, HOUR: TruncHour, DAY: TruncDay}
+LENGTH = {
+    MINUTE: datetime.timedelta(minutes=1),
+    HOUR: datetime.timedelta(hours=1),
+    DAY: datetime.timedelta(days=1),
+}
+# SQLite stores times as UTC text: the start of a bucket is a prefix,
+# completed by a suffix into a time Python can parse
+PREFIX = {MINUTE: (16, ''), HOUR: (13, ':00'), DAY: (10, '')}
+# a vote may commit this long after its cast_at and still be counted
+COMMIT_DELAY = datetime.timedelta(minutes=1)
+# time ranges ORed together in one query of count_buckets()
+SPANS_PER_QUERY = 50
+
+
+def bucket(period):
+    """Return the expression of the bucket start of a vote, in UTC.
+
+    On SQLite, Trunc calls back into Python for every row; a prefix of
+    the stored text is the same bucket without leaving SQLite.
+    """
+    if connection.vendor == 'sqlite':
+        return Substr('cast_at', 1, PREFIX[period][0])
+    return TRUNCATE[period]('cast_at', tzinfo=datetime.timezone.utc)
+
+
+def bucket_start(period, value):
+    """Return the start of a bucket from the value of bucket()."""
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(
+            value + PREFIX[period][1]).replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def truncate(moment, period):
+    """Return the start of the bucket of a time, in UTC."""
+    moment = moment.astimezone(datetime.timezone.utc).replace(
+        second=0, microsecond=0)
+    if period == MINUTE:
+        return moment
+    if period == HOUR:
+        return moment.replace(minute=0)
+    return moment.replace(hour=0, minute=0)
+
+
+def touched_votes(since):
+    """Return (question id, cast_at) of the votes cast or changed since.
+
+    They are few, and found through the cast_at and changed_at indexes.
+    """
+    return Vote.objects.filter(
+        Q(cast_at__gte=since) | Q(changed_at__gte=since)).exclude(
+            cast_at=None).values_list('question', 'cast_at')
+
+
+def touched_buckets(period, since=None):
+    """Return the bucket starts per question of votes cast or changed since.
+
+    With since None, every bucket that has a vote, archived or not, is
+    returned; archived votes no longer change.
+    """
+    touched = defaultdict(set)
+    if since is not None:
+        for question_id, cast_at in touched_votes(since):
+            touched[question_id].add(truncate(cast_at, period))
+        return touched
+    for model in (Vote, ArchivedVote):
+        for question_id, start in model.objects.exclude(
+                cast_at=None).annotate(start=bucket(period)).order_by(
+                ).values_list('question', 'start').distinct():
+            touched[question_id].add(bucket_start(period, start))
+    return touched
+
+
+def spans(period, starts):
+    """Return the (low, high) time ranges of buckets, adjacent ones merged."""
+    length = LENGTH[period]
+    ranges = []
+    for start in sorted(starts):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = start + length
+        else:
+            ranges.append([start, start + length])
+    return [tuple(span) for span in ranges]
+
+
+def span_counts(model, question_id, period, time_ranges):
+    """Return the query of (choice, start, votes) of votes in time ranges."""
+    in_ranges = Q()
+    for low, high in time_ranges:
+        in_ranges |= Q(cast_at__gte=low, cast_at__lt=high)
+    return model.objects.filter(in_ranges, question=question_id).annotate(
+        start=bucket(period)).order_by().values_list(
+            'choice', 'start').annotate(votes=Count('id'))
+
+
+def count_buckets(question_id, period, starts, every_bucket=False):
+    """Return the votes per (choice id, start) of buckets of a question.
+
+    Only the votes of the buckets are read, through the (question,
+    cast_at) index: one range per run of adjacent buckets, at most
+    SPANS_PER_QUERY ranges per grouped query. every_bucket tells that
+    starts holds every bucket with votes, so one range from the first to
+    the last reads the same votes in one query.
+    """
+    if every_bucket:
+        time_ranges = [(min(starts), max(starts) + LENGTH[period])]
+    else:
+        time_ranges = spans(period, starts)
+    counts = Counter()
+    for index in range(0, len(time_ranges), SPANS_PER_QUERY):
+        batch = time_ranges[index:index + SPANS_PER_QUERY]
+        for model in (Vote, ArchivedVote):
+            for choice_id, start, votes in span_counts(model, question_id,
+                                                       period, batch):
+                counts[choice_id, bucket_start(period, start)] += votes
+    return counts
+
+
+def recount(question_id, period, starts, every_bucket=False,
+            batch_size=500):
+    """Replace the rollups of buckets of a question by a new count."""
+    starts = sorted(starts)
+    counts = count_buckets(question_id, period, starts, every_bucket)
+    with transaction.atomic():
+        rollups = VoteRollup.objects.filter(question=question_id,
+                                            period=period)
+        for index in range(0, len(starts), batch_size):
+            rollups.filter(
+                start__in=starts[index:index + batch_size]).delete()
+        VoteRollup.objects.bulk_create(
+            (VoteRollup(question_id=question_id, choice_id=choice_id,
+                        period=period, start=start, votes=votes)
+             for (choice_id, start), votes in counts.items()),
+            batch_size=batch_size)
+
+
+def update_rollups(now=None, full=False):
+    """Count the buckets touched since the last run; return how many.
+
+    full counts every bucket again and drops rollups left without votes.
+    Votes are read from the primary: a replica that is behind would miss
+    votes the watermark then moves past.
+    """
+    now = now or timezone.now()
+    with pin_primary():
+        state = VoteRollupState.objects.first()
+        since = None
+        if state and not full:
+            since = state.counted_until - COMMIT_DELAY
+        if since is None:
+            VoteRollup.objects.all().delete()
+        recounted = 0
+        for period in TRUNCATE:
+            for question_id, starts in touched_buckets(period, since).items():
+                recount(question_id, period, starts, since is None)
+                recounted += len(starts)
+        VoteRollupState.objects.update_or_create(
+            pk=1, defaults={'counted_until': now})
+    return recounted
+
+
+def latest_starts(rows, buckets):
+    """Return the query of the latest bucket starts of rollup rows."""
+    return rows.order_by('-start').values_list(
+        'start', flat=True).distinct()[:buckets]
+
+
+def turnout(question, period=HOUR, buckets=48):
+    """Return the latest buckets of a question, oldest first.
+
+    Each item is (start, total, {choice id: votes}).
+    """
+    rows = VoteRollup.objects.filter(question=question, period=period)
+    starts = list(latest_starts(rows, buckets))
+    if not starts:
+        return []
+    series = defaultdict(dict)
+    for start, choice_id, votes in rows.filter(
+            start__gte=starts[-1]).values_list('start', 'choice', 'votes'):
+        series[start][choice_id] = votes
+    return [(start, sum(series[start].values()), series[start])
+            for start in sorted(series)]
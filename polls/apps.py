@@ -1,7 +1,13 @@
 
 from django.apps import AppConfig
+from django.core import checks
 
 
 class PollsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "polls"
+
+    def ready(self):
+        from . import receivers  # noqa: F401
+        from .cache import check_shared_cache
+        checks.register(check_shared_cache, checks.Tags.caches, deploy=True)
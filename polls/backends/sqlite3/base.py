@@ -0,0 +1,14 @@
+"""SQLite backend whose transactions take the write lock when they begin.
+
+A plain BEGIN takes the write lock at the first write of the transaction.
+If another connection has written in between, SQLite cannot wait for the
+lock and the transaction fails at once with "database is locked", whatever
+the busy timeout. BEGIN IMMEDIATE waits for the lock up front instead; it
+is the transaction_mode option of Django 5.1.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
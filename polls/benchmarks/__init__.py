@@ -0,0 +1,74 @@
+"""Benchmarks for the polls app.
+
+Run them with ``python manage.py benchmark <name>``. Every benchmark runs in
+a throw-away test database, so the data of the site is never touched.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls.models import Choice, Question
+
+BENCHMARKS = ['concurrency', 'contention', 'endpoints', 'render', 'search',
+              'tallies', 'votes']
+
+
+@contextmanager
+def benchmark_database():
+    """Create a test database for the duration of the block.
+
+    SQLite test databases are normally kept in memory; the benchmark one is a
+    file so that commits and the write lock cost what they cost on the site.
+    The test client's host name is allowed while the block runs.
+    """
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    directory = None
+    if connection.vendor == 'sqlite' and not old_test_name:
+        directory = tempfile.mkdtemp(prefix='polls-benchmark-')
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def seed(questions, choices, users):
+    """Create open questions with choices, and users who can vote.
+
+    Return a (questions, users) tuple; every question has its choices
+    prefetched.
+    """
+    now = timezone.now()
+    Question.objects.bulk_create(
+        Question(question_text=f"Benchmark question {number}",
+                 pub_date=now - datetime.timedelta(days=1),
+                 end_date=now + datetime.timedelta(days=30))
+        for number in range(questions))
+    question_list = list(Question.objects.order_by('id'))
+    Choice.objects.bulk_create(
+        (Choice(question=question, choice_text=f"Choice {number}")
+         for question in question_list for number in range(choices)),
+        batch_size=500)
+    User.objects.bulk_create(
+        (User(username=f"benchmark{number}", password='!')
+         for number in range(users)),
+        batch_size=500)
+    question_list = list(
+        Question.objects.order_by('id').prefetch_related('choice_set'))
+    return question_list, list(User.objects.order_by('id'))
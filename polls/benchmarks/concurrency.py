@@ -0,0 +1,95 @@
+"""Concurrent reads of the sync (WSGI) and async (ASGI) poll views."""
+import asyncio
+import importlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import clear_url_caches, reverse
+
+import polls.urls
+from polls.benchmarks import seed
+from polls.metrics import percentiles
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8,
+                        help="Worker threads of the WSGI run.")
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help="Requests in flight in the ASGI run.")
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--choices', type=int, default=4)
+
+
+@contextmanager
+def async_views(enabled):
+    """Route the read views to the async or the sync views."""
+    with override_settings(POLLS_ASYNC_VIEWS=enabled):
+        importlib.reload(polls.urls)
+        clear_url_caches()
+        try:
+            yield
+        finally:
+            importlib.reload(polls.urls)
+            clear_url_caches()
+
+
+def summary(latencies, seconds):
+    """Return the throughput and latency numbers of one run."""
+    return {
+        'requests_per_second': len(latencies) / seconds,
+        'latency_ms': {name: value * 1000 for name, value
+                       in percentiles(latencies).items()},
+    }
+
+
+def run_wsgi(urls, threads):
+    """Request urls from a pool of threads like a threaded WSGI server."""
+    def fetch(url):
+        start = time.perf_counter()
+        Client().get(url)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(fetch, urls))
+    return summary(latencies, time.perf_counter() - start)
+
+
+def run_asgi(urls, concurrency):
+    """Request urls from one event loop like an ASGI worker."""
+    async def fetch(client, limit, url):
+        async with limit:
+            start = time.perf_counter()
+            await client.get(url)
+            return time.perf_counter() - start
+
+    async def fetch_all():
+        client = AsyncClient()
+        limit = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(
+            *(fetch(client, limit, url) for url in urls))
+
+    start = time.perf_counter()
+    latencies = asyncio.run(fetch_all())
+    return summary(latencies, time.perf_counter() - start)
+
+
+def run(options):
+    """Serve the same mix of read requests both ways."""
+    questions, _ = seed(options['questions'], options['choices'], 0)
+    pages = [reverse('polls:index')]
+    for question in questions:
+        pages.append(reverse('polls:detail', args=(question.id,)))
+        pages.append(reverse('polls:results', args=(question.id,)))
+    urls = [pages[number % len(pages)]
+            for number in range(options['requests'])]
+    with async_views(False):
+        wsgi = run_wsgi(urls, options['threads'])
+    with async_views(True):
+        asgi = run_asgi(urls, options['concurrency'])
+    return {'requests': len(urls), 'wsgi': wsgi, 'asgi': asgi}
@@ -0,0 +1,120 @@
+"""Concurrent votes and page reads against one database.
+
+Threads send a mix of vote posts and detail page reads, like a threaded
+WSGI server under load. Run it with DATABASE_PROFILE=development and
+DATABASE_PROFILE=production to compare connection reuse and the SQLite
+tuning of the production profile.
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from polls.benchmarks import seed
+from polls.metrics import percentiles
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--vote-share', type=float, default=0.2,
+                        help="Fraction of the requests that are votes.")
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def summary(samples, seconds):
+    """Return the count, errors, rate and latency of one kind of request."""
+    latencies = [latency for latency, _ in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'requests_per_second': len(samples) / seconds,
+        'latency_ms': {name: value * 1000 for name, value
+                       in percentiles(latencies).items()},
+    }
+
+
+def database_profile():
+    """Describe the connection settings the run used."""
+    with connection.cursor() as cursor:
+        pragmas = {}
+        if connection.vendor == 'sqlite':
+            for name in ('journal_mode', 'synchronous', 'busy_timeout',
+                         'mmap_size'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+    return {
+        'profile': settings.DATABASE_PROFILE,
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        **pragmas,
+    }
+
+
+def run(options):
+    """Send the requests from a pool of threads and time each kind."""
+    generator = random.Random(options['seed'])
+    questions, users = seed(options['questions'], options['choices'],
+                            options['users'])
+    clients = []
+    for user in users:
+        # exceptions are reported through a global signal, so a client
+        # that raises them would raise those of the other threads too
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        clients.append(client)
+    threads = options['threads']
+    work = [[] for _ in range(threads)]
+    for number in range(options['requests']):
+        worker = number % threads
+        # every thread has clients of its own, so no client is shared
+        client = generator.choice(clients[worker::threads])
+        question = generator.choice(questions)
+        if generator.random() < options['vote_share']:
+            choice = generator.choice(question.choice_set.all())
+            work[worker].append(
+                ('votes', client, 'post',
+                 reverse('polls:vote', args=(question.id,)),
+                 {'choice': choice.id}))
+        else:
+            work[worker].append(
+                ('reads', client, 'get',
+                 reverse('polls:detail', args=(question.id,)), None))
+    profile = database_profile()
+    connection.close()
+
+    def serve(requests):
+        samples = []
+        for kind, client, method, url, data in requests:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            samples.append((kind, time.perf_counter() - start,
+                            response.status_code < 400))
+        return samples
+
+    # failed requests are counted, not logged one by one
+    logger = logging.getLogger('django.request')
+    disabled, logger.disabled = logger.disabled, True
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            samples = [sample for samples in pool.map(serve, work)
+                       for sample in samples]
+    finally:
+        logger.disabled = disabled
+    seconds = time.perf_counter() - start
+    return {
+        'database': profile,
+        'requests_per_second': len(samples) / seconds,
+        **{kind: summary([(latency, ok) for name, latency, ok in samples
+                          if name == kind], seconds)
+           for kind in ('votes', 'reads')},
+    }
@@ -0,0 +1,99 @@
+"""Latency, throughput and queries per request of the poll endpoints."""
+import random
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from polls.benchmarks import seed
+from polls.metrics import percentiles
+from polls.models import Vote
+
+ENDPOINTS = ('index', 'detail', 'results', 'vote')
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--choices', type=int, default=5)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--votes', type=int, default=2000,
+                        help="Votes cast before the requests are timed.")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="Timed requests per endpoint.")
+    parser.add_argument('--clients', type=int, default=20,
+                        help="Logged in clients that take turns.")
+    parser.add_argument('--endpoint', action='append', dest='endpoints',
+                        choices=ENDPOINTS,
+                        help="Endpoint to time; can be repeated "
+                             "(default: all).")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def measure(requests):
+    """Time a list of (client, method, url, data) requests.
+
+    Return the latency percentiles, requests per second and queries per
+    request of the list.
+    """
+    latencies = []
+    queries = 0
+    errors = 0
+    started = time.perf_counter()
+    for client, method, url, data in requests:
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            latencies.append(time.perf_counter() - start)
+        queries += len(captured)
+        errors += response.status_code >= 400
+    seconds = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': len(latencies) / seconds,
+        'queries_per_request': queries / len(latencies),
+        'latency_ms': {name: value * 1000 for name, value
+                       in percentiles(latencies).items()},
+    }
+
+
+def run(options):
+    """Seed the database and time every endpoint in turn."""
+    generator = random.Random(options['seed'])
+    questions, users = seed(options['questions'], options['choices'],
+                            options['users'])
+    votes = {}
+    for _ in range(options['votes']):
+        question = generator.choice(questions)
+        choice = generator.choice(question.choice_set.all())
+        votes[(generator.choice(users).id, question.id)] = choice.id
+    Vote.objects.cast_many(votes)
+    clients = []
+    for user in users[:options['clients']]:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    cache.clear()
+
+    def requests(endpoint):
+        for number in range(options['requests']):
+            client = clients[number % len(clients)]
+            question = generator.choice(questions)
+            if endpoint == 'index':
+                yield client, 'get', reverse('polls:index'), None
+            elif endpoint == 'vote':
+                choice = generator.choice(question.choice_set.all())
+                yield (client, 'post',
+                       reverse('polls:vote', args=(question.id,)),
+                       {'choice': choice.id})
+            else:
+                yield (client, 'get',
+                       reverse(f'polls:{endpoint}', args=(question.id,)),
+                       None)
+
+    return {endpoint: measure(list(requests(endpoint)))
+            for endpoint in options['endpoints'] or ENDPOINTS}
@@ -0,0 +1,75 @@
+"""Template render time of the question pages with and without fragments."""
+import random
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from polls.benchmarks import seed
+from polls.metrics import RequestMetrics, current_metrics, percentiles
+from polls.models import Vote
+
+PAGES = ('detail', 'results')
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--choices', type=int, default=10)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500,
+                        help="Timed requests per page and mode.")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def measure(client, urls):
+    """Request urls and return their template, wall time and query numbers."""
+    template_times = []
+    wall_times = []
+    queries = 0
+    for url in urls:
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with connection.execute_wrapper(metrics.record_query):
+                start = time.perf_counter()
+                client.get(url)
+                wall_times.append(time.perf_counter() - start)
+        finally:
+            current_metrics.reset(token)
+        template_times.append(metrics.template_time)
+        queries += metrics.queries
+    return {
+        'template_ms': {name: value * 1000 for name, value
+                        in percentiles(template_times).items()},
+        'wall_ms': {name: value * 1000 for name, value
+                    in percentiles(wall_times).items()},
+        'queries_per_request': queries / len(urls),
+    }
+
+
+def run(options):
+    """Render the detail and results pages with fragments off and on."""
+    generator = random.Random(options['seed'])
+    questions, users = seed(options['questions'], options['choices'],
+                            options['users'])
+    Vote.objects.cast_many({
+        (user.id, question.id): generator.choice(
+            question.choice_set.all()).id
+        for user in users for question in questions})
+    client = Client()
+    client.force_login(users[0])
+    results = {}
+    for page in PAGES:
+        urls = [reverse(f'polls:{page}', args=(generator.choice(
+                    questions).id,))
+                for _ in range(options['requests'])]
+        for mode, timeout in (('uncached', 0), ('fragments', 600)):
+            cache.clear()
+            with override_settings(POLLS_FRAGMENT_CACHE_TIMEOUT=timeout):
+                measure(client, urls[:len(questions)])  # warm up
+                results.setdefault(page, {})[mode] = measure(client, urls)
+    return results
@@ -0,0 +1,86 @@
+"""Search latency of LIKE scans against the FTS5 and SearchTerm indexes."""
+import datetime
+import random
+import string
+import time
+
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls.metrics import percentiles
+from polls.models import Question
+from polls.pagination import ORDERING
+from polls.search import rebuild_index, search_filter
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--questions', type=int, default=200000)
+    parser.add_argument('--words', type=int, default=20000,
+                        help="Size of the vocabulary of the questions.")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def seed_questions(generator, count, vocabulary):
+    """Create count questions of six random words each."""
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, count, 5000):
+            Question.objects.bulk_create(
+                (Question(question_text=' '.join(generator.choices(
+                              vocabulary, k=6)),
+                          pub_date=now - datetime.timedelta(minutes=number),
+                          end_date=now + datetime.timedelta(days=1))
+                 for number in range(start, min(start + 5000, count))),
+                batch_size=1000)
+
+
+def time_searches(search, words, page_size):
+    """Time one page of results for every word."""
+    latencies = []
+    for word in words:
+        start = time.perf_counter()
+        list(search(word).order_by(*ORDERING)[:page_size])
+        latencies.append(time.perf_counter() - start)
+    return {name: value * 1000 for name, value
+            in percentiles(latencies).items()}
+
+
+def run(options):
+    """Seed questions and time the same searches three ways."""
+    generator = random.Random(options['seed'])
+    vocabulary = sorted({
+        ''.join(generator.choices(string.ascii_lowercase,
+                                  k=generator.randint(4, 9)))
+        for _ in range(options['words'])})
+    seed_questions(generator, options['questions'], vocabulary)
+    words = generator.choices(vocabulary, k=options['queries'])
+    # words in no question make LIKE read the whole table
+    misses = [f'{word}q' for word in words]
+    page_size = options['page_size']
+    questions = Question.objects.all()
+
+    def like(word):
+        return questions.filter(question_text__icontains=word)
+
+    results = {
+        'questions': options['questions'],
+        'like_ms': time_searches(like, words, page_size),
+        'like_miss_ms': time_searches(like, misses, page_size),
+    }
+    for backend, name in (('auto', 'fts5'), ('terms', 'search_terms')):
+        with override_settings(POLLS_SEARCH_BACKEND=backend):
+            start = time.perf_counter()
+            with transaction.atomic():
+                rebuild_index()
+            results[f'{name}_index_seconds'] = time.perf_counter() - start
+            results[f'{name}_ms'] = time_searches(
+                lambda word: search_filter(questions, word), words,
+                page_size)
+            results[f'{name}_miss_ms'] = time_searches(
+                lambda word: search_filter(questions, word), misses,
+                page_size)
+    return results
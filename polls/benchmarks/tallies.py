@@ -0,0 +1,84 @@
+"""Vote throughput for one hot choice with its tally split into shards.
+
+Threads vote for the same choice at once, each vote by a new user, for
+every shard count asked for. On databases with row locks, more shards
+mean fewer votes waiting for the same tally row; SQLite locks the whole
+database for every write, so there the numbers only show the cost of the
+shards. Run it with DATABASE_PROFILE=production on SQLite so writers wait
+for the lock instead of failing.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from polls.benchmarks import seed
+from polls.metrics import percentiles
+from polls.models import Choice, ChoiceTallyShard, Vote, keeping_tallies
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--votes', type=int, default=2000,
+                        help="Votes per shard count.")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--shards', default='0,1,4,16',
+                        help="Comma separated shard counts to compare "
+                             "(0 is the single vote_count column).")
+
+
+def cast_votes(users, choice):
+    """Vote for choice as each user; return the latencies and failures."""
+    latencies = []
+    failures = 0
+    try:
+        for user in users:
+            start = time.perf_counter()
+            try:
+                Vote.objects.cast(user, choice)
+            except OperationalError:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connection.close()
+    return latencies, failures
+
+
+def run(options):
+    """Send the same votes from a pool of threads for each shard count."""
+    threads = options['threads']
+    questions, users = seed(1, 2, options['votes'])
+    choice = questions[0].choice_set.all()[0]
+    work = [users[worker::threads] for worker in range(threads)]
+    results = {}
+    for shards in [int(count) for count in options['shards'].split(',')]:
+        with keeping_tallies():
+            Vote.objects.all().delete()
+        ChoiceTallyShard.objects.all().delete()
+        Choice.objects.update(vote_count=0)
+        connection.close()
+        with override_settings(POLLS_TALLY_SHARDS=shards):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                outcomes = list(pool.map(cast_votes, work,
+                                         [choice] * threads))
+            seconds = time.perf_counter() - start
+        failures = sum(failed for _, failed in outcomes)
+        tally = Choice.objects.with_tallies().get(pk=choice.pk).votes
+        if tally != len(users) - failures:
+            raise AssertionError(f"{shards} shards counted {tally} votes, "
+                                 f"expected {len(users) - failures}.")
+        shard_rows = ChoiceTallyShard.objects.count()
+        compacted_start = time.perf_counter()
+        ChoiceTallyShard.objects.compact()
+        results[f'shards_{shards}'] = {
+            'votes_per_second': (len(users) - failures) / seconds,
+            'failed_votes': failures,
+            'latency_ms': {name: value * 1000 for name, value in percentiles(
+                [latency for latencies, _ in outcomes
+                 for latency in latencies]).items()},
+            'shard_rows': shard_rows,
+            'compact_seconds': time.perf_counter() - compacted_start,
+        }
+    return results
@@ -0,0 +1,66 @@
+"""Vote throughput of direct writes against the write-behind buffer."""
+import random
+import time
+
+from polls.benchmarks import seed
+from polls.buffer import VoteBuffer
+from polls.models import Choice, ChoiceTallyShard, Vote, keeping_tallies
+
+
+def add_arguments(parser):
+    """Add the options of this benchmark."""
+    parser.add_argument('--votes', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--questions', type=int, default=5)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--buffer-size', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def tallies():
+    """Return the stored tally of every choice."""
+    return dict(Choice.objects.with_tallies().values_list('id', 'tally'))
+
+
+def run(options):
+    """Cast the same random votes directly and through the buffer."""
+    questions, users = seed(options['questions'], options['choices'],
+                            options['users'])
+    generator = random.Random(options['seed'])
+    votes = []
+    for _ in range(options['votes']):
+        question = generator.choice(questions)
+        choice = generator.choice(question.choice_set.all())
+        votes.append((generator.choice(users), choice))
+
+    start = time.perf_counter()
+    for user, choice in votes:
+        Vote.objects.cast(user, choice)
+    direct_seconds = time.perf_counter() - start
+    direct_tallies = tallies()
+
+    with keeping_tallies():
+        Vote.objects.all().delete()
+    Choice.objects.update(vote_count=0)
+    ChoiceTallyShard.objects.all().delete()
+    buffer = VoteBuffer(size=options['buffer_size'], interval=3600)
+    start = time.perf_counter()
+    for user, choice in votes:
+        buffer.add(user.id, choice.question_id, choice.id)
+    buffer.flush()
+    buffered_seconds = time.perf_counter() - start
+    if tallies() != direct_tallies:
+        raise AssertionError("Buffered votes produced different tallies.")
+
+    return {
+        'votes': len(votes),
+        'direct': {
+            'seconds': direct_seconds,
+            'votes_per_second': len(votes) / direct_seconds,
+        },
+        'buffered': {
+            'seconds': buffered_seconds,
+            'votes_per_second': len(votes) / buffered_seconds,
+        },
+        'speedup': direct_seconds / buffered_seconds,
+    }
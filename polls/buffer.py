@@ -0,0 +1,181 @@
+"""Write-behind buffer that batches votes before writing them to the database.
+
+When POLLS_VOTE_BUFFER is on, the vote view adds votes to the buffer of its
+process instead of writing each one. Only the last vote of a user on a
+question is kept. The buffer is written with Vote.objects.cast_many() when it
+holds POLLS_VOTE_BUFFER_SIZE votes or POLLS_VOTE_BUFFER_INTERVAL seconds after
+the first buffered vote, whichever comes first.
+
+POLLS_VOTE_BUFFER_DURABILITY chooses what happens to votes that are not yet
+written when the process dies:
+
+* ``memory``: they are lost. The buffer is written at normal interpreter exit.
+* ``journal``: every vote is appended to a journal file and synced to disk
+  before the view returns. ``python manage.py flush_votes`` writes the votes
+  from journals left behind by processes that stopped before flushing.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from .models import Vote
+from .routers import pin_primary
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no fcntl
+    fcntl = None
+
+DURABILITY_MODES = ('memory', 'journal')
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """Collect votes in memory and write them in batches."""
+
+    def __init__(self, size=500, interval=2.0, durability='memory',
+                 journal_dir=None):
+        if durability not in DURABILITY_MODES:
+            raise ImproperlyConfigured(
+                f"POLLS_VOTE_BUFFER_DURABILITY must be one of "
+                f"{', '.join(DURABILITY_MODES)}, not {durability!r}.")
+        self.size = size
+        self.interval = interval
+        self.durability = durability
+        self.journal_dir = Path(journal_dir) if journal_dir else None
+        self.pending = {}
+        self.started = None
+        self.timer = None
+        self.journal = None
+        self.lock = threading.RLock()
+
+    def add(self, user_id, question_id, choice_id):
+        """Buffer a vote, writing the buffer if a threshold is reached."""
+        with self.lock:
+            if self.durability == 'journal':
+                self._write_journal(user_id, question_id, choice_id)
+            self.pending[(user_id, question_id)] = choice_id
+            if self.started is None:
+                self.started = time.monotonic()
+                self._start_timer()
+            full = len(self.pending) >= self.size
+            late = time.monotonic() - self.started >= self.interval
+        if full or late:
+            self._flush_or_log()
+
+    def flush(self):
+        """Write the buffered votes and return how many were written."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.started = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not pending:
+                return 0
+            try:
+                written = Vote.objects.cast_many(pending)
+            except Exception:
+                # keep the votes and retry them when the timer fires
+                pending.update(self.pending)
+                self.pending = pending
+                self.started = time.monotonic()
+                self._start_timer()
+                raise
+            if self.journal is not None:
+                self.journal.truncate(0)
+                self.journal.seek(0)
+            return written
+
+    def _start_timer(self):
+        """Flush from a background thread once the interval has passed."""
+        self.timer = threading.Timer(self.interval, self._flush_in_thread)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _flush_or_log(self):
+        """Flush, logging a failure instead of raising it.
+
+        The votes stay buffered and the timer retries them, so a failed
+        write does not fail the request or thread that triggered it.
+        """
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Writing %d buffered votes failed; retrying in "
+                             "%s seconds.", len(self.pending), self.interval)
+
+    def _flush_in_thread(self):
+        """Flush and close the connection the timer thread opened."""
+        try:
+            # the thread has no request pinning it to the primary
+            with pin_primary():
+                self._flush_or_log()
+        finally:
+            connections.close_all()
+
+    def _write_journal(self, user_id, question_id, choice_id):
+        """Append a vote to this process's journal and sync it to disk."""
+        if self.journal is None:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            path = self.journal_dir / f"votes-{os.getpid()}.jsonl"
+            self.journal = open(path, 'a+', encoding='utf-8')
+            if fcntl is not None:
+                fcntl.flock(self.journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.journal.write(json.dumps([user_id, question_id, choice_id]))
+        self.journal.write('\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+
+def replay_journals(journal_dir):
+    """Write the votes of journals that no running process holds.
+
+    Return a (journals, votes) tuple with the number of journals replayed
+    and the number of votes written from them.
+    """
+    journals = votes = 0
+    for path in sorted(Path(journal_dir).glob('votes-*.jsonl')):
+        with open(path, 'r+', encoding='utf-8') as journal:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+            pending = {}
+            for line in journal:
+                if line.strip():
+                    user_id, question_id, choice_id = json.loads(line)
+                    pending[(user_id, question_id)] = choice_id
+            votes += Vote.objects.cast_many(pending)
+        path.unlink()
+        journals += 1
+    return journals, votes
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Return the vote buffer of this process, creating it on first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = VoteBuffer(
+                size=settings.POLLS_VOTE_BUFFER_SIZE,
+                interval=settings.POLLS_VOTE_BUFFER_INTERVAL,
+                durability=settings.POLLS_VOTE_BUFFER_DURABILITY,
+                journal_dir=settings.POLLS_VOTE_BUFFER_JOURNAL_DIR,
+            )
+            atexit.register(_buffer.flush)
+        return _buffer
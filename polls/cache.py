@@ -0,0 +1,318 @@
+"""Caching of poll pages in Django's cache framework."""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import CLOSED, OPEN, Question
+from .pagination import akeyset_page, keyset_page
+from .routers import pin_primary
+
+INDEX_KEY = 'polls:index'
+# backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """Warn when the default cache is not shared between processes.
+
+    Results versions and index invalidations are cache entries: in a
+    per-process cache, a vote only reaches the worker that took it, and
+    the other workers serve old results, ETags and streams.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+    return [checks.Warning(
+        f"The default cache ({backend}) is private to each process.",
+        hint="Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by "
+             "every worker, such as Redis or Memcached, unless the site "
+             "runs in a single process.",
+        id='polls.W001',
+    )]
+
+
+def index_queryset(now, state=None):
+    """Return the questions published by now, with their state.
+
+    state limits them to the OPEN or CLOSED questions.
+    """
+    if state == OPEN:
+        queryset = Question.objects.open(now)
+    elif state == CLOSED:
+        queryset = Question.objects.closed(now)
+    else:
+        queryset = Question.objects.published(now)
+    return queryset.with_state(now)
+
+
+def next_pub_date_queryset(now):
+    """Return the pub_date of the next question to be published."""
+    return Question.objects.upcoming(now).order_by(
+        'pub_date').values_list('pub_date', flat=True)
+
+
+def timeout_until(now, next_pub_date, questions=()):
+    """Return the cache timeout of the index at now.
+
+    The index changes when the next question is published or when one of
+    the open questions it lists closes.
+    """
+    boundaries = [question.end_date for question in questions
+                  if question.state == OPEN]
+    if next_pub_date is not None:
+        boundaries.append(next_pub_date)
+    timeout = settings.POLLS_INDEX_CACHE_TIMEOUT
+    if boundaries:
+        timeout = min(timeout, (min(boundaries) - now).total_seconds())
+    return max(timeout, 1)
+
+
+def is_first_page(state, cursor, page_size):
+    """Tell if the arguments ask for the default first index page."""
+    return (state is None and cursor is None
+            and page_size == settings.POLLS_INDEX_PAGE_SIZE)
+
+
+def get_index_page(state=None, cursor=None, page_size=None):
+    """Return a page of published questions and the cursor of the next.
+
+    Only the default first page, which most visitors see, is cached: the
+    questions and their state are kept until the next question is
+    published or a listed one closes, so they stay right without a database
+    query. Saving or deleting a question clears them, so the page is read
+    again from the primary database.
+    """
+    page_size = page_size or settings.POLLS_INDEX_PAGE_SIZE
+    now = timezone.now()
+    if not is_first_page(state, cursor, page_size):
+        return keyset_page(index_queryset(now, state), cursor, page_size)
+    page = cache.get(INDEX_KEY)
+    if page is None:
+        with pin_primary():
+            page = keyset_page(index_queryset(now), None, page_size)
+            timeout = index_timeout(now, page[0])
+        cache.set(INDEX_KEY, page, timeout)
+    return page
+
+
+async def aget_index_page(state=None, cursor=None, page_size=None):
+    """Async version of get_index_page()."""
+    page_size = page_size or settings.POLLS_INDEX_PAGE_SIZE
+    now = timezone.now()
+    if not is_first_page(state, cursor, page_size):
+        return await akeyset_page(index_queryset(now, state), cursor,
+                                  page_size)
+    page = await cache.aget(INDEX_KEY)
+    if page is None:
+        with pin_primary():
+            page = await akeyset_page(index_queryset(now), None, page_size)
+            next_pub_date = await next_pub_date_queryset(now).afirst()
+        await cache.aset(INDEX_KEY, page,
+                         timeout_until(now, next_pub_date, page[0]))
+    return page
+
+
+def index_timeout(now, questions=()):
+    """Return the seconds the index of questions stays right after now."""
+    return timeout_until(now, next_pub_date_queryset(now).first(), questions)
+
+
+def invalidate_index():
+    """Forget the cached index page."""
+    cache.delete(INDEX_KEY)
+
+
+class CacheStats:
+    """Count the hits and misses of a cache in this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def record(self, outcome):
+        """Count one lookup with outcome 'hit', 'stale_hit' or 'miss'."""
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def as_dict(self):
+        """Return the counts and the share of lookups served from cache."""
+        with self.lock:
+            counts = dict(self.counts)
+        lookups = sum(counts.values())
+        hits = counts.get('hit', 0) + counts.get('stale_hit', 0)
+        return {
+            'hits': counts.get('hit', 0),
+            'stale_hits': counts.get('stale_hit', 0),
+            'misses': counts.get('miss', 0),
+            'hit_ratio': hits / lookups if lookups else 0.0,
+        }
+
+    def reset(self):
+        """Set all counts back to zero."""
+        with self.lock:
+            self.counts.clear()
+
+
+results_stats = CacheStats()
+
+
+def results_version_key(question_id):
+    """Return the cache key of the results version of a question."""
+    return f'polls:results-version:{question_id}'
+
+
+def question_version_key(question_id):
+    """Return the cache key of the version of a question and its choices.
+
+    Unlike the results version, votes leave it alone: only saving or
+    deleting the question or its choices bumps it.
+    """
+    return f'polls:question-version:{question_id}'
+
+
+def new_results_version():
+    """Return a version number that no earlier version can have used.
+
+    A missing version starts from the clock, so a version that was evicted
+    from the cache never repeats one that older entries were stored under.
+    """
+    return time.time_ns() // 1000
+
+
+def get_version(key):
+    """Return the version stored under key, starting it if missing."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_results_version(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key):
+    """Async version of get_version()."""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, new_results_version(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key):
+    """Move the version stored under key on."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_version(key)
+
+
+def get_results_version(question_id):
+    """Return the current results version of a question."""
+    return get_version(results_version_key(question_id))
+
+
+async def aget_results_version(question_id):
+    """Async version of get_results_version()."""
+    return await aget_version(results_version_key(question_id))
+
+
+def bump_results_version(question_id):
+    """Make the cached results of a question out of date."""
+    bump_version(results_version_key(question_id))
+
+
+def get_question_version(question_id):
+    """Return the current version of a question and its choices."""
+    return get_version(question_version_key(question_id))
+
+
+async def aget_question_version(question_id):
+    """Async version of get_question_version()."""
+    return await aget_version(question_version_key(question_id))
+
+
+def bump_question_version(question_id):
+    """Make the cached choice list of a question out of date."""
+    bump_version(question_version_key(question_id))
+
+
+def results_keys(question_id, version):
+    """Return the keys of the current and the latest results of a question."""
+    return (f'polls:results:{question_id}:{version}',
+            f'polls:results:{question_id}:latest')
+
+
+def get_versioned_results(question):
+    """Return the results version and the choices of a question with tallies.
+
+    Results are stored under the current results version of the question,
+    which every vote bumps. With POLLS_RESULTS_STALENESS set to N seconds,
+    results up to N seconds old are served even after newer votes; the
+    version returned is then the older one the results belong to, so what
+    is cached under it stays right.
+
+    Misses read the primary database: results of a lagging replica would
+    stay cached under the new version.
+    """
+    version = get_results_version(question.id)
+    key, latest_key = results_keys(question.id, version)
+    staleness = settings.POLLS_RESULTS_STALENESS
+    choices = cache.get(key)
+    if choices is not None:
+        results_stats.record('hit')
+        return version, choices
+    if staleness:
+        latest = cache.get(latest_key)
+        if latest is not None:
+            results_stats.record('stale_hit')
+            return latest
+    results_stats.record('miss')
+    with pin_primary():
+        choices = question.get_results()
+    cache.set(key, choices, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    if staleness:
+        cache.set(latest_key, (version, choices), staleness)
+    return version, choices
+
+
+def get_results(question):
+    """Return the choices of a question with tallies, from cache if possible.
+
+    See get_versioned_results().
+    """
+    return get_versioned_results(question)[1]
+
+
+async def aget_versioned_results(question):
+    """Async version of get_versioned_results()."""
+    version = await aget_results_version(question.id)
+    key, latest_key = results_keys(question.id, version)
+    staleness = settings.POLLS_RESULTS_STALENESS
+    choices = await cache.aget(key)
+    if choices is not None:
+        results_stats.record('hit')
+        return version, choices
+    if staleness:
+        latest = await cache.aget(latest_key)
+        if latest is not None:
+            results_stats.record('stale_hit')
+            return latest
+    results_stats.record('miss')
+    with pin_primary():
+        choices = await question.aget_results()
+    await cache.aset(key, choices, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    if staleness:
+        await cache.aset(latest_key, (version, choices), staleness)
+    return version, choices
+
+
+async def aget_results(question):
+    """Async version of get_results()."""
+    return (await aget_versioned_results(question))[1]
@@ -0,0 +1,114 @@
+"""Server-sent events that push the results of a question as votes arrive.
+
+Every change of the tallies bumps the results version of the question (see
+polls.cache), which is what the streams watch. Inside one process the
+broker wakes the streams of a question as soon as its tallies change;
+streams also check the version on every heartbeat, so votes taken by
+other processes reach them through a shared cache. However many votes
+arrive, a stream sends at most one update per POLLS_STREAM_INTERVAL
+seconds.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .cache import (aget_results, aget_results_version, get_results,
+                    get_results_version)
+
+
+class ResultsBroker:
+    """In-process publish/subscribe of tally changes per question."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.changes = defaultdict(int)
+
+    def publish(self, question_id):
+        """Wake the streams waiting on a question."""
+        with self.condition:
+            self.changes[question_id] += 1
+            self.condition.notify_all()
+
+    def seen(self, question_id):
+        """Return the number of changes of a question so far."""
+        with self.condition:
+            return self.changes[question_id]
+
+    def wait(self, question_id, seen, timeout):
+        """Wait until a question changes after seen changes, or timeout.
+
+        Return the number of changes of the question so far.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.changes[question_id] != seen, timeout)
+            return self.changes[question_id]
+
+
+broker = ResultsBroker()
+
+
+def results_data(question, choices):
+    """Return the results of a question as a JSON-ready dict."""
+    return {
+        'question': question.id,
+        'total': sum(choice.votes for choice in choices),
+        'choices': [{'id': choice.id, 'text': choice.choice_text,
+                     'votes': choice.votes, 'share': choice.share}
+                    for choice in choices],
+    }
+
+
+def results_event(question, choices, version):
+    """Return the results of a question as one server-sent event."""
+    data = json.dumps(results_data(question, choices))
+    return f"id: {version}\nevent: results\ndata: {data}\n\n"
+
+
+def stream_results(question):
+    """Yield the results of a question whenever they change."""
+    deadline = time.monotonic() + settings.POLLS_STREAM_DURATION
+    yield f"retry: {settings.POLLS_STREAM_RETRY_MS}\n\n"
+    seen = broker.seen(question.id)
+    sent_version = None
+    while True:
+        version = get_results_version(question.id)
+        if version != sent_version:
+            sent_version = version
+            yield results_event(question, get_results(question), version)
+            time.sleep(settings.POLLS_STREAM_INTERVAL)
+        else:
+            yield ": keep-alive\n\n"
+        if time.monotonic() >= deadline:
+            return
+        seen = broker.wait(question.id, seen,
+                           settings.POLLS_STREAM_HEARTBEAT)
+
+
+async def astream_results(question):
+    """Async version of stream_results() for ASGI servers.
+
+    It checks the results version every POLLS_STREAM_INTERVAL seconds
+    instead of waiting on the broker, so no thread is held per client.
+    """
+    deadline = time.monotonic() + settings.POLLS_STREAM_DURATION
+    yield f"retry: {settings.POLLS_STREAM_RETRY_MS}\n\n"
+    sent_version = None
+    quiet_since = time.monotonic()
+    while True:
+        version = await aget_results_version(question.id)
+        if version != sent_version:
+            sent_version = version
+            quiet_since = time.monotonic()
+            yield results_event(question, await aget_results(question),
+                                version)
+        elif time.monotonic() - quiet_since >= settings.POLLS_STREAM_HEARTBEAT:
+            quiet_since = time.monotonic()
+            yield ": keep-alive\n\n"
+        if time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(settings.POLLS_STREAM_INTERVAL)
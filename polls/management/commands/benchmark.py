@@ -0,0 +1,53 @@
+"""Run one of the benchmarks in polls/benchmarks in a test database."""
+import json
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+
+from polls.benchmarks import BENCHMARKS, benchmark_database
+
+
+# options of every command, left out of the JSON report
+BASE_OPTIONS = {'benchmark', 'json_path', 'verbosity', 'settings',
+                'pythonpath', 'traceback', 'no_color', 'force_color',
+                'skip_checks'}
+
+
+def flatten(results, prefix=''):
+    """Yield (name, value) pairs of nested benchmark results."""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{name}.")
+        else:
+            yield f"{prefix}{name}", value
+
+
+class Command(BaseCommand):
+    """Seed a throw-away database, run a benchmark and report the numbers."""
+    help = "Run a polls benchmark in a temporary test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', dest='json_path',
+                            help="Also write the results to this JSON file.")
+        benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+        for name in BENCHMARKS:
+            module = import_module(f'polls.benchmarks.{name}')
+            module.add_arguments(benchmarks.add_parser(
+                name, help=module.__doc__.splitlines()[0]))
+
+    def handle(self, *args, **options):
+        module = import_module(f"polls.benchmarks.{options['benchmark']}")
+        with benchmark_database():
+            results = module.run(options)
+        for name, value in flatten(results):
+            if isinstance(value, float):
+                value = f"{value:.4f}"
+            self.stdout.write(f"{name}: {value}")
+        if options['json_path']:
+            settings = {name: value for name, value in options.items()
+                        if name not in BASE_OPTIONS}
+            with open(options['json_path'], 'w', encoding='utf-8') as output:
+                json.dump({'benchmark': options['benchmark'],
+                           'options': settings,
+                           'results': results}, output, indent=2,
+                          sort_keys=True)
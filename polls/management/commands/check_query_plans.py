@@ -0,0 +1,29 @@
+"""Fail when a hot query of the polls app reads a whole table."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from polls.queryplans import full_scans, hot_queries
+
+
+class Command(BaseCommand):
+    """EXPLAIN every hot query and report the ones without an index."""
+    help = "Run EXPLAIN on the hot queries and fail on full table scans."
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset in hot_queries().items():
+            tables = full_scans(queryset)
+            if tables is None:
+                raise CommandError(
+                    f"Query plans of {connection.vendor} are not checked.")
+            if tables:
+                failures.append(name)
+                self.stdout.write(
+                    f"{name}: full scan of {', '.join(tables)}\n"
+                    f"{queryset.explain()}")
+            else:
+                self.stdout.write(f"{name}: ok")
+        if failures:
+            raise CommandError(
+                f"Full table scans in: {', '.join(failures)}.")
+        self.stdout.write(self.style.SUCCESS("All hot queries use indexes."))
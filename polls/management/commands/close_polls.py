@@ -0,0 +1,40 @@
+"""Take the result snapshots of closed polls and archive their votes."""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from polls.models import ArchivedVote, Question, ResultSnapshot, Vote
+from polls.routers import pin_primary
+
+
+class Command(BaseCommand):
+    """Freeze the results of every poll whose tallies can no longer change."""
+    help = ("Take the result snapshot of every closed poll that has none, "
+            "and optionally move its votes to the archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archive-votes', action='store_true',
+            help="Move the votes of closed polls from Vote to ArchivedVote.",
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    @pin_primary()
+    def handle(self, *args, **options):
+        final = Question.objects.final(timezone.now())
+        taken = 0
+        # a poll reopened and closed again has a snapshot of its old end
+        stale = final.exclude(resultsnapshot__end_date=F('end_date'))
+        for question in stale.iterator(chunk_size=options['batch_size']):
+            ResultSnapshot.objects.take(question)
+            taken += 1
+        message = f"Took {taken} result snapshots."
+        if options['archive_votes']:
+            question_ids = Vote.objects.filter(
+                question__in=final.filter(
+                    resultsnapshot__end_date=F('end_date'))
+            ).order_by().values_list('question', flat=True).distinct()
+            moved = ArchivedVote.objects.archive(question_ids,
+                                                 options['batch_size'])
+            message += f" Archived {moved} votes."
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,21 @@
+"""Fold the tally shards of choices back into Choice.vote_count."""
+from django.core.management.base import BaseCommand
+
+from polls.models import ChoiceTallyShard
+from polls.routers import pin_primary
+
+
+class Command(BaseCommand):
+    """Move the deltas of every tally shard to its choice."""
+    help = ("Add the tally shards of every choice to its vote_count and "
+            "delete them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Choices compacted per transaction.")
+
+    @pin_primary()
+    def handle(self, *args, **options):
+        compacted = ChoiceTallyShard.objects.compact(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted the tallies of {compacted} choices."))
@@ -0,0 +1,50 @@
+"""Stream users, questions, choices and votes out of the database."""
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.transfer import (MODEL_LABELS, Progress, export_records,
+                            write_csv, write_jsonl)
+
+
+class Command(BaseCommand):
+    """Export rows as JSON Lines or CSV without loading whole tables."""
+    help = "Export users, questions, choices and votes as JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write, or - for stdout.")
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            default='jsonl')
+        parser.add_argument('--model', action='append', dest='models',
+                            help="Model to export, e.g. polls.vote; can be "
+                                 "repeated (default: all). CSV takes one.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def counted(self, records, progress):
+        """Yield records and count them in progress."""
+        for record in records:
+            yield record
+            progress.add(1)
+
+    def handle(self, *args, **options):
+        labels = options['models'] or MODEL_LABELS
+        if options['format'] == 'csv' and len(labels) != 1:
+            raise CommandError("A CSV file holds one model; give one --model.")
+        progress = Progress(self.stderr.write)
+        stream = (sys.stdout if options['path'] == '-'
+                  else open(options['path'], 'w', encoding='utf-8',
+                            newline=''))
+        try:
+            for label in labels:
+                records = self.counted(
+                    export_records(label, options['batch_size']), progress)
+                if options['format'] == 'csv':
+                    write_csv(stream, label, records)
+                else:
+                    write_jsonl(stream, records)
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        self.stderr.write(f"Exported {progress.summary()}.")
@@ -0,0 +1,27 @@
+"""Write buffered votes that were left in vote journals."""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.buffer import replay_journals
+from polls.routers import pin_primary
+
+
+class Command(BaseCommand):
+    """Replay the vote journals of stopped processes."""
+    help = ("Write the votes in journals left by processes that stopped "
+            "before flushing their vote buffer.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--journal-dir', default=settings.POLLS_VOTE_BUFFER_JOURNAL_DIR,
+            help="Directory of the vote journals "
+                 "(default: POLLS_VOTE_BUFFER_JOURNAL_DIR).",
+        )
+
+    @pin_primary()
+    def handle(self, *args, **options):
+        # the buffers of running processes are theirs to flush: this
+        # process has buffered nothing, and their journals are locked
+        journals, replayed = replay_journals(options['journal_dir'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {replayed} votes from {journals} journals."))
@@ -0,0 +1,45 @@
+"""Stream users, questions, choices and votes into the database."""
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from polls.routers import pin_primary
+from polls.transfer import FORMATS, Importer, Progress, read_records
+
+
+class Command(BaseCommand):
+    """Import a JSON Lines, CSV or JSON fixture file in batches."""
+    help = ("Import users, questions, choices and votes from a JSON Lines, "
+            "CSV or JSON fixture file with batched inserts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="Format of the file (default: from the "
+                                 "file extension).")
+        parser.add_argument('--model',
+                            help="Model of a CSV file, e.g. polls.vote.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    @pin_primary()
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or Path(path).suffix.lstrip('.').lower()
+        if format not in FORMATS:
+            raise CommandError(f"Give --format, one of {', '.join(FORMATS)}.")
+        progress = Progress(self.stderr.write)
+        importer = Importer(options['batch_size'], progress)
+        stream = (sys.stdin if path == '-'
+                  else open(path, encoding='utf-8', newline=''))
+        try:
+            importer.add(read_records(stream, format, options['model']))
+            importer.finish()
+        except (IntegrityError, ValueError) as error:
+            raise CommandError(error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {progress.summary()}."))
@@ -0,0 +1,17 @@
+"""Rebuild the search index of questions and choices."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from polls.search import rebuild_index, uses_fts
+
+
+class Command(BaseCommand):
+    """Index every question again, after changes that skipped signals."""
+    help = "Rebuild the full-text search index of the questions."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_index()
+        backend = 'FTS5' if uses_fts() else 'search terms'
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} questions ({backend})."))
@@ -0,0 +1,36 @@
+"""Rebuild or check Choice.vote_count from the Vote and ArchivedVote rows."""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from polls.models import Choice, send_tallies_changed
+from polls.routers import pin_primary
+
+
+class Command(BaseCommand):
+    """Compare the stored tallies with the Vote table and repair them."""
+    help = ("Rebuild the stored vote tally of every choice from the Vote and "
+            "ArchivedVote rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report choices whose tally is wrong, do not fix them.",
+        )
+
+    @pin_primary()
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            wrong = Choice.objects.recount(fix=not options['check'])
+            for choice, total in wrong:
+                self.stdout.write(
+                    f"Choice {choice.id}: stored {choice.votes}, "
+                    f"counted {total}")
+            if options['check']:
+                if wrong:
+                    raise CommandError(
+                        f"{len(wrong)} tallies are out of date.")
+                self.stdout.write(
+                    self.style.SUCCESS("All tallies are correct."))
+                return
+            send_tallies_changed({choice.question_id for choice, _ in wrong})
+        self.stdout.write(self.style.SUCCESS(f"Fixed {len(wrong)} tallies."))
@@ -0,0 +1,23 @@
+"""Bring the turnout rollups of votes up to date."""
+from django.core.management.base import BaseCommand
+
+from polls.analytics import update_rollups
+from polls.routers import pin_primary
+
+
+class Command(BaseCommand):
+    """Count the rollup buckets of the votes cast or changed since last run."""
+    help = ("Update the per minute, hour and day vote counts of every "
+            "choice from the votes cast or changed since the last run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Count every bucket again, e.g. after deleting votes.",
+        )
+
+    @pin_primary()
+    def handle(self, *args, **options):
+        recounted = update_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {recounted} buckets."))
@@ -0,0 +1,128 @@
+"""Per-request query and timing metrics of the polls views.
+
+RequestMetricsMiddleware fills a RequestMetrics for each request while
+POLLS_METRICS is on: the queries and their time through
+connection.execute_wrapper(), and the template render time through the
+InstrumentedDjangoTemplates backend. Finished requests go into a rolling
+histogram per view that the metrics view reports.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Return the given percentiles of samples, by the nearest-rank method."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f'p{point}': 0.0 for point in points}
+    return {
+        f'p{point}': ordered[max(0, -(-point * len(ordered) // 100) - 1)]
+        for point in points
+    }
+
+
+class RequestMetrics:
+    """Query count and time spent of one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper that times every query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class RollingHistogram:
+    """Keep the last samples of each request metric of a view."""
+
+    def __init__(self, size):
+        self.count = 0
+        self.samples = {name: deque(maxlen=size)
+                        for name in ('wall_ms', 'db_ms', 'template_ms',
+                                     'queries')}
+
+    def add(self, **values):
+        """Add the metrics of one request."""
+        self.count += 1
+        for name, value in values.items():
+            self.samples[name].append(value)
+
+    def summary(self):
+        """Return the request count and percentiles of every metric."""
+        result = {'requests': self.count}
+        for name, samples in self.samples.items():
+            result[name] = percentiles(samples)
+        return result
+
+
+class MetricsRegistry:
+    """Rolling histograms of the requests of each view in this process."""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.views = defaultdict(lambda: RollingHistogram(self.size))
+
+    def record(self, view_name, wall_time, metrics):
+        """Add a finished request of a view."""
+        with self.lock:
+            self.views[view_name].add(
+                wall_ms=wall_time * 1000, db_ms=metrics.db_time * 1000,
+                template_ms=metrics.template_time * 1000,
+                queries=metrics.queries)
+
+    def summary(self):
+        """Return the summary of every view."""
+        with self.lock:
+            return {name: histogram.summary()
+                    for name, histogram in sorted(self.views.items())}
+
+    def reset(self):
+        """Forget all recorded requests."""
+        with self.lock:
+            self.views.clear()
+
+
+registry = MetricsRegistry()
+
+
+class TimedTemplate(Template):
+    """Template that adds its render time to the current request metrics."""
+
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend whose templates are timed per request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name),
+                                 self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
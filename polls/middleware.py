@@ -0,0 +1,106 @@
+"""Middleware of the polls app."""
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import RequestMetrics, current_metrics, registry
+from .querycheck import QueryRecorder, RepeatedQueriesError, describe
+from .routers import pin_primary
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """Record query count, database, template and wall time per view.
+
+    The numbers of each request are added to the metrics registry and sent
+    back in a Server-Timing header. With POLLS_METRICS off the middleware
+    removes itself when the server starts, so it costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not settings.POLLS_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        wall_time = time.perf_counter() - start
+        match = request.resolver_match
+        registry.record(match.view_name if match else 'unresolved',
+                        wall_time, metrics)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.2f};'
+            f'desc="{metrics.queries} queries"',
+            f'template;dur={metrics.template_time * 1000:.2f}',
+            f'total;dur={wall_time * 1000:.2f}',
+        ])
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """Read from the primary database right after a browser writes.
+
+    Requests that may write (not GET, HEAD or OPTIONS) read from the
+    primary and set a cookie that pins the next requests of the browser for
+    POLLS_REPLICA_STICKY_SECONDS. Without DATABASE_REPLICAS the middleware
+    is not loaded.
+    """
+
+    cookie_name = 'polls_primary'
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        if not (writes or self.cookie_name in request.COOKIES):
+            return self.get_response(request)
+        with pin_primary():
+            response = self.get_response(request)
+        if writes:
+            response.set_cookie(self.cookie_name, '1',
+                                max_age=settings.POLLS_REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class QueryCheckMiddleware:
+    """Warn about or fail requests that repeat a query (POLLS_NPLUSONE)."""
+
+    def __init__(self, get_response):
+        self.mode = settings.POLLS_NPLUSONE
+        if self.mode not in ('off', 'warn', 'raise'):
+            raise ImproperlyConfigured(
+                "POLLS_NPLUSONE must be 'off', 'warn' or 'raise'.")
+        if self.mode == 'off':
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.installed():
+            response = self.get_response(request)
+        repeated = recorder.repeated(settings.POLLS_NPLUSONE_THRESHOLD)
+        if repeated:
+            message = describe(repeated, request.path)
+            if self.mode == 'raise':
+                raise RepeatedQueriesError(message)
+            logger.warning(message)
+        return response
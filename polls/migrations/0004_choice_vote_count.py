@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+
+def count_votes(apps, schema_editor):
+    """Fill the new tally column from the existing Vote rows."""
+    Choice = apps.get_model("polls", "Choice")
+    Vote = apps.get_model("polls", "Vote")
+    db_alias = schema_editor.connection.alias
+    tallies = (
+        Vote.objects.using(db_alias)
+        .values("choice")
+        .annotate(total=models.Count("id"))
+    )
+    for row in tallies:
+        Choice.objects.using(db_alias).filter(pk=row["choice"]).update(
+            vote_count=row["total"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0003_remove_choice_votes_vote"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="choice",
+            name="vote_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_question(apps, schema_editor):
+    """Copy the question of each vote's choice onto the vote."""
+    Vote = apps.get_model("polls", "Vote")
+    Choice = apps.get_model("polls", "Choice")
+    db_alias = schema_editor.connection.alias
+    question = Choice.objects.filter(pk=models.OuterRef("choice")).values(
+        "question"
+    )
+    Vote.objects.using(db_alias).update(question=models.Subquery(question[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0004_choice_vote_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vote",
+            name="question",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="polls.question",
+            ),
+        ),
+        migrations.RunPython(copy_question, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="vote",
+            name="question",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="polls.question"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(
+                fields=["user", "question"], name="polls_vote_user_question"
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Keep only the latest vote of each user on each question."""
+    Choice = apps.get_model("polls", "Choice")
+    Vote = apps.get_model("polls", "Vote")
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        Vote.objects.using(db_alias).order_by()
+        .values("user", "question")
+        .annotate(latest=models.Max("id"), total=models.Count("id"))
+        .filter(total__gt=1)
+    )
+    for row in duplicates.iterator():
+        Vote.objects.using(db_alias).filter(
+            user=row["user"], question=row["question"]
+        ).exclude(pk=row["latest"]).delete()
+    tally = (
+        Vote.objects.filter(choice=models.OuterRef("pk"))
+        .order_by()
+        .values("choice")
+        .annotate(total=models.Count("id"))
+        .values("total")
+    )
+    Choice.objects.using(db_alias).update(
+        vote_count=models.functions.Coalesce(models.Subquery(tally), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0005_vote_question"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="vote",
+            name="polls_vote_user_question",
+        ),
+        migrations.AddConstraint(
+            model_name="vote",
+            constraint=models.UniqueConstraint(
+                fields=("user", "question"), name="polls_vote_one_per_question"
+            ),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:36
+
+import re
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+import django.db.models.deletion
+
+FTS_TABLE = "polls_question_fts"
+
+
+def create_search_index(apps, schema_editor):
+    """Create the FTS5 table on SQLite builds that have FTS5 and fill it.
+
+    Databases without FTS5 get SearchTerm rows instead.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                f"question_text, choice_text)"
+            )
+        except OperationalError:
+            pass  # SQLite built without FTS5
+        else:
+            schema_editor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, question_text, choice_text) "
+                f"SELECT q.id, q.question_text, "
+                f"COALESCE(GROUP_CONCAT(c.choice_text, ' '), '') "
+                f"FROM polls_question q "
+                f"LEFT JOIN polls_choice c ON c.question_id = q.id "
+                f"GROUP BY q.id"
+            )
+            return
+    Question = apps.get_model("polls", "Question")
+    SearchTerm = apps.get_model("polls", "SearchTerm")
+    db_alias = connection.alias
+    terms = []
+    for question in (
+        Question.objects.using(db_alias).prefetch_related("choice_set").iterator(
+            chunk_size=2000
+        )
+    ):
+        texts = [question.question_text]
+        texts.extend(choice.choice_text for choice in question.choice_set.all())
+        words = dict.fromkeys(
+            word.casefold()[:100] for word in re.findall(r"\w+", " ".join(texts))
+        )
+        terms.extend(SearchTerm(term=word, question=question) for word in words)
+        if len(terms) >= 2000:
+            SearchTerm.objects.using(db_alias).bulk_create(terms)
+            terms = []
+    SearchTerm.objects.using(db_alias).bulk_create(terms)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0007_question_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchTerm",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("term", models.CharField(max_length=100)),
+                (
+                    "question",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="polls.question",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["term", "question"], name="polls_searchterm_term"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0009_result_snapshots"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChoiceTallyShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("delta", models.IntegerField(default=0)),
+                (
+                    "choice",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="polls.choice"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="choicetallyshard",
+            constraint=models.UniqueConstraint(
+                fields=("choice", "shard"), name="polls_tallyshard_one_per_shard"
+            ),
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0010_tally_shards"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VoteRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[
+                            ("minute", "Minute"),
+                            ("hour", "Hour"),
+                            ("day", "Day"),
+                        ],
+                        max_length=6,
+                    ),
+                ),
+                ("start", models.DateTimeField()),
+                ("votes", models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="VoteRollupState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("counted_until", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="archivedvote",
+            name="cast_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="archivedvote",
+            name="changed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="vote",
+            name="cast_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="vote",
+            name="changed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(fields=["cast_at"], name="polls_vote_cast_at"),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(
+                fields=["question", "cast_at"], name="polls_vote_question_cast_at"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(fields=["changed_at"], name="polls_vote_changed_at"),
+        ),
+        migrations.AddField(
+            model_name="voterollup",
+            name="choice",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="polls.choice"
+            ),
+        ),
+        migrations.AddField(
+            model_name="voterollup",
+            name="question",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="polls.question"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voterollup",
+            index=models.Index(
+                fields=["question", "period", "start"], name="polls_voterollup_question"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="voterollup",
+            constraint=models.UniqueConstraint(
+                fields=("choice", "period", "start"), name="polls_voterollup_bucket"
+            ),
+        ),
+    ]
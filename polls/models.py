@@ -1,11 +1,65 @@
 
 """This module contains  Question, Choice and Vote models for the Polls app."""
 import datetime
+import random
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import admin
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import (Case, Count, F, OuterRef, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+from .routers import pin_primary
+from .signals import tallies_changed
+
+
+# set while deleted votes are moved, not withdrawn, see keeping_tallies()
+tallies_kept = ContextVar('tallies_kept', default=False)
+
+UPCOMING = 'upcoming'
+OPEN = 'open'
+CLOSED = 'closed'
+
+
+class QuestionQuerySet(models.QuerySet):
+    """Queries of questions by their state at a given time."""
+
+    def published(self, now):
+        """Questions published by now."""
+        return self.filter(pub_date__lte=now)
+
+    def upcoming(self, now):
+        """Questions that are not published yet."""
+        return self.filter(pub_date__gt=now)
+
+    def open(self, now):
+        """Published questions that can still be voted on."""
+        return self.filter(pub_date__lte=now, end_date__gte=now)
+
+    def closed(self, now):
+        """Published questions whose polling period is over."""
+        return self.filter(pub_date__lte=now, end_date__lt=now)
+
+    def final(self, now):
+        """Closed questions whose tallies can no longer change."""
+        return self.filter(pub_date__lte=now,
+                           end_date__lt=now - settle_time())
+
+    def with_state(self, now):
+        """Annotate state: 'upcoming', 'open' or 'closed' at now."""
+        return self.annotate(state=Case(
+            When(pub_date__gt=now, then=Value(UPCOMING)),
+            When(end_date__lt=now, then=Value(CLOSED)),
+            default=Value(OPEN),
+            output_field=models.CharField(),
+        ))
+
 
 class Question(models.Model):
     """Django model Object for Question."""
@@ -13,61 +67,553 @@ class Question(models.Model):
     pub_date = models.DateTimeField('date published')
     end_date = models.DateTimeField('end_date')
 
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pub_date', 'id'],
+                         name='polls_question_pub_date'),
+            models.Index(fields=['end_date', 'pub_date'],
+                         name='polls_question_end_date'),
+        ]
+
     @admin.display(
         boolean=True,
         ordering='pub_date',
         description='Published recently?',
     )
-    def was_published_recently(self):
+    def was_published_recently(self, now=None):
         """if the question was published recently."""
-        now = timezone.now()
+        now = now or timezone.now()
         return now - datetime.timedelta(days=1) <= self.pub_date <= now
 
-    def is_published(self):
+    def is_published(self, now=None):
         """if the question is published."""
-        now = timezone.now()
+        now = now or timezone.now()
         return self.pub_date <= now
 
-    def can_vote(self):
+    def can_vote(self, now=None):
         """if the question is in polling period."""
-        now = timezone.now()
+        now = now or timezone.now()
         if self.end_date:
-            return self.is_published and now <= self.end_date
-        return self.is_published()
+            return self.is_published(now) and now <= self.end_date
+        return self.is_published(now)
+
+    def is_final(self, now=None):
+        """if the tallies of the question can no longer change."""
+        now = now or timezone.now()
+        return (self.is_published(now) and self.end_date is not None
+                and self.end_date < now - settle_time())
+
+    def get_state(self, now=None):
+        """Return 'upcoming', 'open' or 'closed', like with_state()."""
+        now = now or timezone.now()
+        if not self.is_published(now):
+            return UPCOMING
+        return OPEN if self.can_vote(now) else CLOSED
 
     def __str__(self):
         """return question string."""
         return self.question_text
 
+    def get_results(self):
+        """Return the choices with their vote tally and percentage share.
+
+        The tallies are stored on Choice, so this is a single query no matter
+        how many choices or votes the question has. Final results are read
+        from the snapshot of the question, which is taken the first time.
+        """
+        if self.is_final():
+            return ResultSnapshot.objects.take(self).get_results()
+        return add_shares(list(self.choice_set.for_results()))
+
+    async def aget_results(self):
+        """Async version of get_results()."""
+        if self.is_final():
+            snapshot = await ResultSnapshot.objects.filter(
+                question=self).afirst()
+            if snapshot is None or not snapshot.matches(self):
+                snapshot = await sync_to_async(ResultSnapshot.objects.take)(
+                    self)
+            return snapshot.get_results()
+        return add_shares([choice async for choice
+                           in self.choice_set.for_results()])
+
     def get_voted_choice(self, user):
-        """Get the choice that is already voted."""
-        for choice in self.choice_set.all():
-            if Vote.objects.filter(choice=choice, user=user).exists():
-                return choice
-        return None
+        """Get the choice that is already voted, or None."""
+        if not user.is_authenticated:
+            return None
+        current_vote = Vote.objects.select_related('choice').filter(
+            user=user, question=self).first()
+        return current_vote.choice if current_vote else None
+
+    async def aget_voted_choice(self, user):
+        """Async version of get_voted_choice()."""
+        if not user.is_authenticated:
+            return None
+        current_vote = await Vote.objects.select_related('choice').filter(
+            user=user, question=self).afirst()
+        return current_vote.choice if current_vote else None
+
+
+def settle_time():
+    """Return how long after its end a poll may still gain votes.
+
+    Buffered votes cast before the end are written up to one flush
+    interval later.
+    """
+    if settings.POLLS_VOTE_BUFFER:
+        return datetime.timedelta(seconds=settings.POLLS_VOTE_BUFFER_INTERVAL)
+    return datetime.timedelta(0)
+
+
+def add_shares(choices):
+    """Set the percentage share of the total votes on each choice."""
+    total = sum(choice.votes for choice in choices)
+    for choice in choices:
+        choice.share = choice.votes * 100 / total if total else 0
+    return choices
+
+
+class ChoiceQuerySet(models.QuerySet):
+    """Queries of choices with their whole tally."""
+
+    def with_tallies(self):
+        """Annotate tally: vote_count plus the deltas of the tally shards."""
+        shards = ChoiceTallyShard.objects.filter(
+            choice=OuterRef('pk')).order_by().values('choice').annotate(
+                total=Sum('delta')).values('total')
+        return self.annotate(
+            tally=F('vote_count') + Coalesce(Subquery(shards), 0))
+
+    def for_results(self):
+        """Choices with their tallies, in the order results list them."""
+        return self.with_tallies().order_by('id')
+
+    def recount(self, fix=True):
+        """Count the Vote and ArchivedVote rows of the choices.
+
+        Return (choice, counted votes) for each choice whose tally is wrong.
+        With fix, its vote_count is set to the count and its shards are
+        dropped. The choices are locked, so run it in a transaction.
+        """
+        choices = list(self.select_for_update().with_tallies().only(
+            'id', 'question_id', 'vote_count'))
+        counted = Counter()
+        for model in (Vote, ArchivedVote):
+            counted.update(dict(model.objects.filter(
+                choice__in=self.values('id')).order_by().values_list(
+                    'choice').annotate(total=Count('id'))))
+        wrong = [(choice, counted.get(choice.id, 0)) for choice in choices
+                 if choice.votes != counted.get(choice.id, 0)]
+        if fix:
+            for choice, total in wrong:
+                choice.vote_count = total
+            Choice.objects.bulk_update([choice for choice, _ in wrong],
+                                       ['vote_count'], batch_size=500)
+            ChoiceTallyShard.objects.filter(
+                choice__in=[choice for choice, _ in wrong]).delete()
+        return wrong
 
 
 class Choice(models.Model):
     """Choice model for creating choices."""
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ChoiceQuerySet.as_manager()
 
     @property
     def votes(self):
-        """count total number of this choice."""
-        return Vote.objects.filter(choice=self).count()
+        """Return the tally of this choice, with its shards if annotated."""
+        return getattr(self, 'tally', self.vote_count)
 
     def __str__(self):
         """Return Choice string."""
         return self.choice_text
 
 
+def send_tallies_changed(question_ids):
+    """Send tallies_changed once the current transaction commits."""
+    question_ids = list(question_ids)
+    transaction.on_commit(lambda: tallies_changed.send(
+        sender=Vote, question_ids=question_ids))
+
+
+def add_to_vote_counts(deltas):
+    """Add deltas, a mapping of choice id to delta, to Choice.vote_count.
+
+    Choices with the same delta share one UPDATE.
+    """
+    by_delta = defaultdict(list)
+    for choice_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(choice_id)
+    for delta, ids in by_delta.items():
+        Choice.objects.filter(pk__in=ids).update(
+            vote_count=F('vote_count') + delta)
+
+
+def add_to_tallies(deltas, user_id=None):
+    """Add deltas, a mapping of choice id to delta, to the tallies.
+
+    With POLLS_TALLY_SHARDS set to K, a delta goes to one of K shard rows
+    of the choice instead of its vote_count, so concurrent votes for one
+    choice do not all wait for the lock of the same row. The shard is
+    picked by user_id, or at random for votes of many users.
+    """
+    shards = settings.POLLS_TALLY_SHARDS
+    if not shards:
+        add_to_vote_counts(deltas)
+        return
+    for choice_id, delta in deltas.items():
+        if not delta:
+            continue
+        if user_id is None:
+            shard = random.randrange(shards)
+        else:
+            shard = user_id % shards
+        add_to_shard(choice_id, shard, delta)
+
+
+def add_to_shard(choice_id, shard, delta):
+    """Add delta to a tally shard of a choice, creating it if needed."""
+    rows = ChoiceTallyShard.objects.filter(choice=choice_id, shard=shard)
+    if rows.update(delta=F('delta') + delta):
+        return
+    try:
+        with transaction.atomic():
+            ChoiceTallyShard.objects.create(choice_id=choice_id,
+                                            shard=shard, delta=delta)
+    except IntegrityError:
+        # a concurrent vote created the shard first
+        rows.update(delta=F('delta') + delta)
+
+
+def withdraw_vote(choice_id, user_id):
+    """Take a deleted vote of user off the tally of a choice.
+
+    vote_count cannot go below zero, so when the votes of the choice sit
+    in its shards (or shards are on) the -1 goes to a shard instead.
+    """
+    shards = settings.POLLS_TALLY_SHARDS
+    if not shards and Choice.objects.filter(
+            pk=choice_id, vote_count__gt=0).update(
+                vote_count=F('vote_count') - 1):
+        return
+    add_to_shard(choice_id, user_id % max(shards, 1), -1)
+
+
+@contextmanager
+def keeping_tallies():
+    """Delete votes inside the block without taking them off the tallies.
+
+    For votes that are moved elsewhere, or tallies that are reset anyway.
+    """
+    token = tallies_kept.set(True)
+    try:
+        yield
+    finally:
+        tallies_kept.reset(token)
+
+
+class VoteManager(models.Manager):
+    """Manager that keeps Choice.vote_count in step with Vote rows."""
+
+    def cast(self, user, choice):
+        """Record the vote of user for choice and update the tallies.
+
+        A user has at most one vote per question, so voting again moves the
+        existing vote and decrements the tally of the old choice. The vote row
+        is locked while it changes and the unique constraint on Vote settles
+        two requests that insert the first vote at the same time.
+        """
+        question_id = choice.question_id
+        with transaction.atomic():
+            current_vote = self.select_for_update().filter(
+                user=user, question=question_id).first()
+            old_choice_id = None
+            if current_vote is None:
+                try:
+                    with transaction.atomic():
+                        current_vote = self.create(user=user, choice=choice,
+                                                   question_id=question_id,
+                                                   cast_at=timezone.now())
+                except IntegrityError:
+                    # a concurrent request inserted this user's vote first
+                    current_vote = self.select_for_update().get(
+                        user=user, question=question_id)
+                    old_choice_id = current_vote.choice_id
+            else:
+                old_choice_id = current_vote.choice_id
+            if old_choice_id == choice.id:
+                return current_vote
+            deltas = {choice.id: 1}
+            if old_choice_id is not None:
+                deltas[old_choice_id] = -1
+                current_vote.choice = choice
+                current_vote.changed_at = timezone.now()
+                current_vote.save(update_fields=['choice', 'changed_at'])
+            add_to_tallies(deltas, current_vote.user_id)
+            send_tallies_changed([question_id])
+        return current_vote
+
+    def cast_many(self, votes):
+        """Record many votes at once with bulk queries.
+
+        votes maps (user_id, question_id) to the id of the chosen choice.
+        Votes for choices that no longer exist are dropped. Return the number
+        of votes recorded.
+        """
+        choice_ids = set(Choice.objects.filter(
+            pk__in=set(votes.values())).values_list('id', flat=True))
+        votes = {key: choice_id for key, choice_id in votes.items()
+                 if choice_id in choice_ids}
+        if not votes:
+            return 0
+        now = timezone.now()
+        with transaction.atomic():
+            existing = {
+                (vote.user_id, vote.question_id): vote
+                for vote in self.select_for_update().filter(
+                    user__in={user_id for user_id, _ in votes},
+                    question__in={question_id for _, question_id in votes})
+            }
+            deltas = Counter()
+            new_votes = []
+            changed_votes = []
+            for (user_id, question_id), choice_id in votes.items():
+                current_vote = existing.get((user_id, question_id))
+                if current_vote is None:
+                    new_votes.append(Vote(user_id=user_id,
+                                          question_id=question_id,
+                                          choice_id=choice_id, cast_at=now))
+                elif current_vote.choice_id != choice_id:
+                    deltas[current_vote.choice_id] -= 1
+                    current_vote.choice_id = choice_id
+                    current_vote.changed_at = now
+                    changed_votes.append(current_vote)
+                else:
+                    continue
+                deltas[choice_id] += 1
+            self.bulk_create(new_votes, batch_size=500)
+            self.bulk_update(changed_votes, ['choice', 'changed_at'],
+                             batch_size=500)
+            add_to_tallies(deltas)
+            send_tallies_changed({question_id for _, question_id in votes})
+        return len(votes)
+
+
 class Vote(models.Model):
     """Vote model for check authenticated user vote"""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # unknown (NULL) for votes recorded before these fields existed, and
+    # for imported votes without them. Only cast() and cast_many() set
+    # changed_at: code that moves a vote some other way must set it, or
+    # run update_rollups(full=True) afterwards.
+    cast_at = models.DateTimeField(null=True, blank=True, editable=False)
+    changed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
-    @property
-    def question(self):
-        """Question of this choice."""
-        return self.choice.question
+    objects = VoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'],
+                                    name='polls_vote_one_per_question'),
+        ]
+        indexes = [
+            models.Index(fields=['cast_at'], name='polls_vote_cast_at'),
+            models.Index(fields=['question', 'cast_at'],
+                         name='polls_vote_question_cast_at'),
+            models.Index(fields=['changed_at'], name='polls_vote_changed_at'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Copy the question of the choice, and time a new vote."""
+        if self.question_id is None:
+            self.question_id = self.choice.question_id
+        if self._state.adding and self.cast_at is None:
+            self.cast_at = timezone.now()
+        super().save(*args, **kwargs)
+
+
+class SearchTerm(models.Model):
+    """A word of a question or its choices, for search without FTS5."""
+    term = models.CharField(max_length=100)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'question'],
+                         name='polls_searchterm_term'),
+        ]
+
+
+class ChoiceTallyShardManager(models.Manager):
+    """Manager that folds tally shards back into Choice.vote_count."""
+
+    def compact(self, batch_size=500):
+        """Move the deltas of the shards to their choices.
+
+        All shards of a choice are folded together, so vote_count never
+        takes a negative part of the tally. Return how many choices
+        were compacted.
+        """
+        compacted = 0
+        while True:
+            with transaction.atomic():
+                choice_ids = list(self.order_by('choice').values_list(
+                    'choice', flat=True).distinct()[:batch_size])
+                if not choice_ids:
+                    return compacted
+                rows = list(self.select_for_update().filter(
+                    choice__in=choice_ids).values_list('id', 'choice',
+                                                       'delta'))
+                deltas = Counter()
+                for _, choice_id, delta in rows:
+                    deltas[choice_id] += delta
+                add_to_vote_counts(deltas)
+                self.filter(id__in=[row_id for row_id, *_ in rows]).delete()
+            compacted += len(choice_ids)
+
+
+class ChoiceTallyShard(models.Model):
+    """A part of the tally of a choice, added to its vote_count on read."""
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(default=0)
+
+    objects = ChoiceTallyShardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'],
+                                    name='polls_tallyshard_one_per_shard'),
+        ]
+
+
+class ResultSnapshotManager(models.Manager):
+    """Manager that takes the snapshots of final results."""
+
+    def take(self, question):
+        """Return the snapshot of question, taking it if there is none.
+
+        A snapshot taken before the question was reopened and closed again
+        is taken anew. The tallies are read from the primary: a replica
+        that is behind would freeze stale results for good.
+        """
+        with pin_primary():
+            snapshot = self.filter(question=question).first()
+            if snapshot is not None and snapshot.matches(question):
+                return snapshot
+            choices = [
+                {'id': choice_id, 'choice_text': text, 'votes': votes}
+                for choice_id, text, votes in question.choice_set.for_results(
+                    ).values_list('id', 'choice_text', 'tally')]
+            # a concurrent request may take the same snapshot first
+            snapshot, _ = self.update_or_create(question=question, defaults={
+                'choices': choices, 'end_date': question.end_date,
+                'taken_at': timezone.now()})
+        return snapshot
+
+
+class ResultSnapshot(models.Model):
+    """The results of a question once they can no longer change."""
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    primary_key=True)
+    choices = models.JSONField()
+    # the end of the question when the snapshot was taken
+    end_date = models.DateTimeField()
+    taken_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ResultSnapshotManager()
+
+    def matches(self, question):
+        """Return True if the snapshot was taken at the current end."""
+        return self.end_date == question.end_date
+
+    def get_results(self):
+        """Return the choices of the snapshot like Question.get_results()."""
+        return add_shares([
+            Choice(id=choice['id'], question_id=self.question_id,
+                   choice_text=choice['choice_text'],
+                   vote_count=choice['votes'])
+            for choice in self.choices])
+
+
+class ArchivedVoteManager(models.Manager):
+    """Manager that moves the votes of final questions out of Vote."""
+
+    def archive(self, question_ids, batch_size=2000):
+        """Move the Vote rows of questions here and return how many moved.
+
+        Tallies and snapshots are left alone: the votes are still counted,
+        they just no longer take room in the table of open polls.
+        """
+        votes = Vote.objects.filter(question__in=list(question_ids))
+        moved = 0
+        while True:
+            with transaction.atomic():
+                batch = list(votes.order_by('id').values(
+                    'id', 'question_id', 'choice_id', 'user_id', 'cast_at',
+                    'changed_at')[:batch_size])
+                if not batch:
+                    return moved
+                self.bulk_create([ArchivedVote(**vote) for vote in batch],
+                                 batch_size=500)
+                with keeping_tallies():
+                    Vote.objects.filter(
+                        id__in=[vote['id'] for vote in batch]).delete()
+            moved += len(batch)
+
+
+class ArchivedVote(models.Model):
+    """A vote of a question whose results are final."""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    cast_at = models.DateTimeField(null=True, blank=True, editable=False)
+    changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ArchivedVoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'question'],
+                name='polls_archivedvote_one_per_question'),
+        ]
+
+
+MINUTE = 'minute'
+HOUR = 'hour'
+DAY = 'day'
+
+
+class VoteRollup(models.Model):
+    """The votes for a choice that were cast in one minute, hour or day."""
+    PERIODS = [(MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day')]
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    period = models.CharField(max_length=6, choices=PERIODS)
+    start = models.DateTimeField()
+    votes = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'period', 'start'],
+                                    name='polls_voterollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'period', 'start'],
+                         name='polls_voterollup_question'),
+        ]
+
+
+class VoteRollupState(models.Model):
+    """Up to when the vote rollups have been counted."""
+    counted_until = models.DateTimeField()
@@ -0,0 +1,70 @@
+"""Keyset (cursor) pagination of questions on (pub_date, id).
+
+A page is the questions just older than a cursor, the (pub_date, id) of the
+last question of the previous page, so every page is one indexed range scan
+however deep it is, unlike OFFSET pagination.
+"""
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+ORDERING = ('-pub_date', '-id')
+
+
+def encode_cursor(question):
+    """Return the cursor of the page after question."""
+    value = f"{question.pub_date.isoformat()}|{question.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (pub_date, id) of a cursor, or raise ValueError."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value = base64.urlsafe_b64decode(padded.encode()).decode()
+        pub_date, pk = value.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor {cursor!r}.")
+    if pub_date is None:
+        raise ValueError(f"Invalid cursor {cursor!r}.")
+    return pub_date, pk
+
+
+def after_cursor(queryset, cursor):
+    """Filter queryset to the questions older than cursor.
+
+    The pub_date__lte bound lets the (pub_date, id) index seek to the cursor.
+    """
+    if not cursor:
+        return queryset
+    pub_date, pk = decode_cursor(cursor)
+    return queryset.filter(Q(pub_date__lte=pub_date),
+                           Q(pub_date__lt=pub_date) | Q(id__lt=pk))
+
+
+def split_page(rows, page_size):
+    """Return rows cut to page_size and the cursor of the next page."""
+    if len(rows) > page_size:
+        return rows[:page_size], encode_cursor(rows[page_size - 1])
+    return rows, None
+
+
+def keyset_page(queryset, cursor, page_size):
+    """Return a page of queryset after cursor and the cursor of the next.
+
+    The next cursor is None on the last page.
+    """
+    rows = list(after_cursor(queryset, cursor).order_by(*ORDERING)[
+        :page_size + 1])
+    return split_page(rows, page_size)
+
+
+async def akeyset_page(queryset, cursor, page_size):
+    """Async version of keyset_page()."""
+    rows = [row async for row in after_cursor(queryset, cursor).order_by(
+        *ORDERING)[:page_size + 1]]
+    return split_page(rows, page_size)
@@ -0,0 +1,113 @@
+"""Find SQL that runs again and again within one request (N+1 queries).
+
+Every query is reduced to a fingerprint: its SQL with the values and the
+length of IN lists taken out. A fingerprint seen more than a threshold of
+times in one request is reported together with where it was run from: the
+template line being rendered, if any, and the innermost frame of the
+project's own code, such as a model property.
+
+Use detect_repeated_queries() in tests, or set POLLS_NPLUSONE to 'warn' or
+'raise' to check every request with polls.middleware.QueryCheckMiddleware.
+"""
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+SPACES = re.compile(r'\s+')
+# instrumentation that wraps the queries and renders of every request
+INSTRUMENTATION = {
+    os.path.join(os.path.dirname(__file__), name)
+    for name in ('querycheck.py', 'metrics.py', 'middleware.py')}
+
+
+class RepeatedQueriesError(AssertionError):
+    """Raised when a request runs the same SQL too many times."""
+
+
+def fingerprint(sql):
+    """Return sql without its values, so similar queries compare equal."""
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = LITERAL.sub('?', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def is_project_file(filename):
+    """Tell if filename is code of this project and not a library."""
+    return (filename.startswith(str(settings.BASE_DIR))
+            and 'site-packages' not in filename
+            and filename not in INSTRUMENTATION)
+
+
+def call_site():
+    """Describe the template line and project code that ran a query."""
+    template_line = code_line = None
+    frame = sys._getframe(1)
+    while frame is not None and not (template_line and code_line):
+        code = frame.f_code
+        if template_line is None and code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            if getattr(node, 'origin', None) is not None:
+                template_line = (f"template {node.origin.name}:"
+                                 f"{node.token.lineno}")
+        if code_line is None and is_project_file(code.co_filename):
+            code_line = (f"{code.co_filename}:{frame.f_lineno} "
+                         f"in {code.co_name}")
+        frame = frame.f_back
+    return ', '.join(filter(None, [template_line, code_line])) or 'unknown'
+
+
+class QueryRecorder:
+    """Execute wrapper that counts queries by fingerprint."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.sites = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        if key not in self.sites:
+            self.sites[key] = call_site()
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """Return (fingerprint, count, call site) of repeated queries."""
+        return [(key, count, self.sites[key])
+                for key, count in self.counts.most_common()
+                if count > threshold]
+
+    @contextmanager
+    def installed(self):
+        """Record the queries of every database connection in the block."""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+
+def describe(repeated, where):
+    """Return an error message for the repeated queries of where."""
+    lines = [f"Repeated queries in {where}:"]
+    for key, count, site in repeated:
+        lines.append(f"  {count}x from {site}: {key}")
+    return '\n'.join(lines)
+
+
+@contextmanager
+def detect_repeated_queries(threshold=None, where='block'):
+    """Raise RepeatedQueriesError if a query repeats more than threshold."""
+    if threshold is None:
+        threshold = settings.POLLS_NPLUSONE_THRESHOLD
+    recorder = QueryRecorder()
+    with recorder.installed():
+        yield recorder
+    repeated = recorder.repeated(threshold)
+    if repeated:
+        raise RepeatedQueriesError(describe(repeated, where))
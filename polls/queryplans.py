@@ -0,0 +1,88 @@
+"""Query plans of the hot queries of the polls views and models.
+
+check_query_plans runs EXPLAIN on each of them and fails when one reads a
+whole table. Querysets and not SQL strings are listed, built with the
+same helpers as the views, models and commands, so that the audit follows
+the code when a query changes.
+"""
+import datetime
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .analytics import latest_starts, span_counts, touched_votes
+from .cache import index_queryset, next_pub_date_queryset
+from .models import (CLOSED, HOUR, OPEN, ArchivedVote, Choice,
+                     ChoiceTallyShard, Question, ResultSnapshot, Vote,
+                     VoteRollup)
+from .pagination import ORDERING, after_cursor, encode_cursor
+from .search import search_filter
+from .views import batch_questions
+
+FULL_SCAN_PATTERNS = {
+    # "SCAN table" without an index; SEARCH lines use an index, and so
+    # do scans of virtual tables (an FTS5 MATCH)
+    'sqlite': re.compile(
+        r'\bSCAN (?!CONSTANT ROW)(\w+)(?!.*\b(?:USING|VIRTUAL TABLE)\b)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+
+
+def hot_queries():
+    """Return the hot queries of the polls app by name."""
+    now = timezone.now()
+    user = User(pk=1)
+    question = Question(pk=1, pub_date=now)
+    cursor = encode_cursor(question)
+    hour = datetime.timedelta(hours=1)
+    buckets = [(now, now + hour), (now + 3 * hour, now + 4 * hour)]
+    return {
+        'index': index_queryset(now).order_by(*ORDERING)[:6],
+        'index older page': after_cursor(index_queryset(now), cursor)
+        .order_by(*ORDERING)[:6],
+        'index open page': index_queryset(now, OPEN).order_by(*ORDERING)[:6],
+        'index closed page': index_queryset(now, CLOSED).order_by(
+            *ORDERING)[:6],
+        'index next pub_date': next_pub_date_queryset(now)[:1],
+        'detail question': Question.objects.filter(pk=1),
+        'search': search_filter(index_queryset(now), 'kasetsart poll')
+        .order_by(*ORDERING)[:21],
+        'detail choices': question.choice_set.all(),
+        'results choices': question.choice_set.for_results(),
+        'batch results questions': batch_questions([1, 2], now),
+        'batch results choices': Choice.objects.filter(
+            question__in=[1, 2]).for_results(),
+        'result snapshot': ResultSnapshot.objects.filter(question=question),
+        'voted choice': Vote.objects.select_related('choice').filter(
+            user=user, question=question)[:1],
+        'vote tally update': Choice.objects.filter(pk__in=[1, 2]),
+        'tally shard update': ChoiceTallyShard.objects.filter(choice=1,
+                                                              shard=0),
+        'buffered votes': Vote.objects.filter(user__in=[1, 2],
+                                              question__in=[1, 2]),
+        'open questions': Question.objects.open(now),
+        'closed questions': Question.objects.closed(now),
+        'questions to snapshot': Question.objects.final(now).exclude(
+            resultsnapshot__end_date=F('end_date')),
+        'votes to archive': Vote.objects.filter(
+            question__in=[1, 2]).order_by('id')[:2000],
+        'rollup touched votes': touched_votes(now),
+        'rollup bucket counts': span_counts(Vote, 1, HOUR, buckets),
+        'rollup archived bucket counts': span_counts(ArchivedVote, 1, HOUR,
+                                                     buckets),
+        'turnout buckets': latest_starts(VoteRollup.objects.filter(
+            question=question, period=HOUR), 48),
+        'admin end_date filter': Question.objects.filter(
+            end_date__gte=now, end_date__lt=now + datetime.timedelta(days=7)),
+    }
+
+
+def full_scans(queryset):
+    """Return the tables queryset reads in full, or None if not checked."""
+    pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        return None
+    return pattern.findall(queryset.explain())
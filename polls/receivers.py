@@ -0,0 +1,85 @@
+"""Signal receivers of the polls app, connected in PollsConfig.ready()."""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import (bump_question_version, bump_results_version,
+                    invalidate_index)
+from .events import broker
+from .models import (ArchivedVote, Choice, Question, Vote,
+                     send_tallies_changed, tallies_kept, withdraw_vote)
+from .search import index_questions, remove_questions
+from .signals import tallies_changed
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Clear the cached pages of a question that is saved or deleted."""
+    invalidate_index()
+    bump_question_version(instance.id)
+    bump_results_version(instance.id)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Clear the cached pages when a choice is edited or removed."""
+    bump_question_version(instance.question_id)
+    bump_results_version(instance.question_id)
+
+
+@receiver(post_delete, sender=Vote)
+@receiver(post_delete, sender=ArchivedVote)
+def vote_deleted(sender, instance, origin, **kwargs):
+    """Take a deleted vote off its tally, e.g. when its user is deleted.
+
+    Votes deleted with their choice or question take their tally along.
+    """
+    if isinstance(origin, QuerySet):
+        origin = origin.model
+    else:
+        origin = type(origin)
+    if tallies_kept.get() or origin in (Choice, Question):
+        return
+    withdraw_vote(instance.choice_id, instance.user_id)
+    send_tallies_changed([instance.question_id])
+
+
+@receiver(post_save, sender=Question)
+def question_indexed(sender, instance, using, **kwargs):
+    """Index the text of a saved question."""
+    index_questions([instance.id], using)
+
+
+@receiver(post_delete, sender=Question)
+def question_unindexed(sender, instance, using, **kwargs):
+    """Remove a deleted question from the search index."""
+    remove_questions([instance.id], using)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_indexed(sender, instance, using, **kwargs):
+    """Index the question of a saved or deleted choice again."""
+    index_questions([instance.question_id], using)
+
+
+@receiver(tallies_changed)
+def tallies_updated(sender, question_ids, **kwargs):
+    """Clear the cached results of questions that got new votes."""
+    for question_id in question_ids:
+        bump_results_version(question_id)
+        broker.publish(question_id)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
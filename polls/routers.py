@@ -0,0 +1,55 @@
+"""Database router that sends reads to replicas and writes to the primary.
+
+Replicas are the aliases in DATABASE_REPLICAS. A request reads from the
+primary instead while it is pinned, which ReplicaStickinessMiddleware does
+for requests that write and, through a cookie, for the requests of the same
+browser during the next POLLS_REPLICA_STICKY_SECONDS, so a user sees their
+own vote even before it reaches the replicas.
+
+Code outside requests that writes what it reads, such as the management
+commands that count votes into tallies, must pin itself too, or it may
+count the rows of a replica that is behind.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+read_from_primary = ContextVar('read_from_primary', default=False)
+
+
+@contextmanager
+def pin_primary():
+    """Read from the primary database inside the block."""
+    token = read_from_primary.set(True)
+    try:
+        yield
+    finally:
+        read_from_primary.reset(token)
+
+
+class ReadReplicaRouter:
+    """Route reads to a random replica unless the context is pinned."""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or read_from_primary.get():
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related objects come from where their instance was read
+            return instance._state.db
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema by replication
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,132 @@
+"""Full-text search of questions by their text and the text of their choices.
+
+Questions are found through an inverted index instead of LIKE '%term%'
+scans. On SQLite with FTS5 the index is the polls_question_fts virtual
+table (one row per question, rowid = question id); elsewhere words are
+split in Python and stored as SearchTerm rows. Receivers in polls.receivers
+keep the index in step with saved and deleted questions and choices; run
+rebuild_search_index after bulk changes that skip signals.
+
+Every word of a search must match; the last one may be the start of a word.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from .models import Choice, Question, SearchTerm
+
+FTS_TABLE = 'polls_question_fts'
+WORD = re.compile(r'\w+')
+MAX_CHAR = chr(0x10ffff)
+_fts_tables = {}
+
+
+def tokenize(text):
+    """Return the distinct lower-case words of text, in order."""
+    max_length = SearchTerm._meta.get_field('term').max_length
+    return list(dict.fromkeys(word.casefold()[:max_length]
+                              for word in WORD.findall(text)))
+
+
+def uses_fts(using='default'):
+    """Tell if the database of alias using searches through FTS5."""
+    if settings.POLLS_SEARCH_BACKEND == 'terms':
+        return False
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            _fts_tables[key] = (
+                FTS_TABLE in connection.introspection.table_names(cursor))
+    return _fts_tables[key]
+
+
+def fts_query(words):
+    """Return the FTS5 MATCH expression of search words."""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_filter(queryset, text):
+    """Filter a queryset of questions to the ones that match text."""
+    words = tokenize(text)
+    if not words:
+        return queryset.none()
+    if uses_fts(queryset.db):
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [fts_query(words)]))
+    for word in words[:-1]:
+        queryset = queryset.filter(id__in=SearchTerm.objects.filter(
+            term=word).values('question'))
+    # a range and not startswith, whose LIKE cannot use the index on SQLite
+    prefix = words[-1]
+    return queryset.filter(id__in=SearchTerm.objects.filter(
+        term__gte=prefix, term__lt=prefix + MAX_CHAR).values('question'))
+
+
+def index_questions(question_ids, using='default'):
+    """Add or refresh the index entries of questions.
+
+    Questions that no longer exist are removed from the index.
+    """
+    question_ids = list(question_ids)
+    texts = dict(Question.objects.using(using).filter(
+        id__in=question_ids).values_list('id', 'question_text'))
+    choices = {question_id: [] for question_id in texts}
+    for question_id, choice_text in Choice.objects.using(using).filter(
+            question__in=question_ids).order_by('id').values_list(
+                'question', 'choice_text'):
+        choices[question_id].append(choice_text)
+    remove_questions(question_ids, using)
+    if uses_fts(using):
+        with connections[using].cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, question_text, choice_text)'
+                f' VALUES (%s, %s, %s)',
+                [(question_id, text, ' '.join(choices[question_id]))
+                 for question_id, text in texts.items()])
+    else:
+        SearchTerm.objects.using(using).bulk_create(
+            (SearchTerm(term=word, question_id=question_id)
+             for question_id, text in texts.items()
+             for word in tokenize(' '.join([text, *choices[question_id]]))),
+            batch_size=500)
+
+
+def remove_questions(question_ids, using='default'):
+    """Remove questions from the index."""
+    question_ids = list(question_ids)
+    if uses_fts(using):
+        with connections[using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                               [(question_id,) for question_id
+                                in question_ids])
+    else:
+        SearchTerm.objects.using(using).filter(
+            question__in=question_ids).delete()
+
+
+def rebuild_index(using='default', batch_size=2000):
+    """Index every question again and return how many were indexed."""
+    if uses_fts(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    else:
+        SearchTerm.objects.using(using).all().delete()
+    ids = Question.objects.using(using).order_by('id').values_list(
+        'id', flat=True)
+    count = 0
+    last_id = 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return count
+        index_questions(batch, using)
+        count += len(batch)
+        last_id = batch[-1]
@@ -0,0 +1,6 @@
+"""Signals sent by the polls app."""
+from django.dispatch import Signal
+
+# Sent after a transaction that changed vote tallies has committed, with
+# question_ids holding the ids of the questions whose tallies changed.
+tallies_changed = Signal()
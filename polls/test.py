@@ -1,11 +1,49 @@
 import datetime
-from django.test import TestCase
+import json
+import tempfile
+from io import StringIO
+from django.core.cache import cache
+from django.template import Context, Template
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import (AsyncRequestFactory, RequestFactory, TestCase,
+                         override_settings)
 from django.utils import timezone
-from polls.models import Question
+from django.utils.http import http_date
+from polls.cache import (bump_results_version, check_shared_cache,
+                         get_results_version, index_timeout, results_keys,
+                         results_stats)
+from polls.admin import QuestionAdmin
+from polls.analytics import count_buckets, spans, truncate, update_rollups
+from polls.buffer import VoteBuffer, get_vote_buffer, replay_journals
+from polls.events import ResultsBroker, stream_results
+from polls.metrics import percentiles, registry
+from polls.middleware import ReplicaStickinessMiddleware
+from polls.models import (HOUR, MINUTE, ArchivedVote, Choice,
+                          ChoiceTallyShard, Question, ResultSnapshot, Vote,
+                          VoteRollup)
+from polls.querycheck import (RepeatedQueriesError,
+                              detect_repeated_queries, fingerprint)
+from polls.queryplans import full_scans
+from polls.receivers import tune_sqlite
+from polls.routers import ReadReplicaRouter, pin_primary
+from polls.search import search_filter, uses_fts
+from polls.transfer import read_json_array
+from polls.views import AsyncDetailView, AsyncIndexView, AsyncResultsView
 from django.urls import reverse
 from django.contrib.auth.models import User
 
 
+@override_settings(POLLS_NPLUSONE='raise', DATABASE_REPLICAS=[])
+class PollsTestCase(TestCase):
+    """TestCase that reads from one database and fails on repeated queries."""
+
 
 def create_question(question_text, start, end):
     """
@@ -19,7 +57,7 @@ def create_question(question_text, start, end):
                                    pub_date=time, end_date=end_time)
 
 
-class QuestionModelTests(TestCase):
+class QuestionModelTests(PollsTestCase):
     def test_was_published_recently_with_future_question(self):
         """
         was_published_recently() returns False for questions whose pub_date
@@ -86,7 +124,47 @@ class QuestionModelTests(TestCase):
         self.assertIs(equal.can_vote(), False)
 
 
-class QuestionIndexViewTests(TestCase):
+class QuestionStateTests(PollsTestCase):
+    def test_can_vote_before_pub_date(self):
+        """can_vote() return False if the question is not published yet"""
+        future = Question(pub_date=timezone.now() + datetime.timedelta(days=1),
+                          end_date=timezone.now() + datetime.timedelta(days=3))
+        self.assertIs(future.can_vote(), False)
+
+    def test_with_state_matches_get_state(self):
+        """The state annotated in SQL agrees with get_state()."""
+        now = timezone.now()
+        create_question("upcoming", start=1, end=3)
+        create_question("open", start=-1, end=3)
+        create_question("closed", start=-3, end=-1)
+        for question in Question.objects.with_state(now):
+            self.assertEqual(question.state, question.get_state(now))
+            self.assertEqual(question.state, question.question_text)
+
+    def test_open_and_closed_filters(self):
+        """open() and closed() split the published questions."""
+        now = timezone.now()
+        open_question = create_question("open", start=-1, end=3)
+        closed_question = create_question("closed", start=-3, end=-1)
+        create_question("upcoming", start=1, end=3)
+        self.assertEqual(list(Question.objects.open(now)), [open_question])
+        self.assertEqual(list(Question.objects.closed(now)),
+                         [closed_question])
+
+    def test_index_cache_expires_when_open_poll_closes(self):
+        """The cached index expires when a listed open question closes."""
+        create_question("open", start=-1, end=1)
+        now = timezone.now()
+        questions = list(Question.objects.published(now).with_state(now))
+        with self.settings(POLLS_INDEX_CACHE_TIMEOUT=10 ** 6):
+            timeout = index_timeout(now, questions)
+        self.assertAlmostEqual(timeout, 24 * 60 * 60, delta=5)
+
+
+class QuestionIndexViewTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_no_questions(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -149,7 +227,91 @@ class QuestionIndexViewTests(TestCase):
         )
 
 
-class QuestionDetailViewTests(TestCase):
+class IndexCacheTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_index_is_cached(self):
+        """A second visit to the index does not query the questions again."""
+        create_question(question_text="Past question.", start=-5, end=2)
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        self.assertEqual(len(response.context['latest_question_list']), 1)
+
+    def test_saving_question_clears_cache(self):
+        """A new question shows up on the index right after it is saved."""
+        self.client.get(reverse('polls:index'))
+        question = create_question(question_text="New question.",
+                                   start=-1, end=2)
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(response.context['latest_question_list'],
+                         [question])
+
+    def test_cache_expires_at_next_pub_date(self):
+        """The index is cached only until the next question is published."""
+        create_question(question_text="Soon.", start=1, end=2)
+        with self.settings(POLLS_INDEX_CACHE_TIMEOUT=10 ** 6):
+            timeout = index_timeout(timezone.now())
+        self.assertAlmostEqual(timeout, 24 * 60 * 60, delta=5)
+
+
+class IndexPaginationTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_older_pages_follow_the_cursor(self):
+        """Pages share no question, even among equal pub_dates."""
+        pub_date = timezone.now() - datetime.timedelta(days=1)
+        questions = [Question.objects.create(
+            question_text=f"Question {number}.", pub_date=pub_date,
+            end_date=pub_date + datetime.timedelta(days=3))
+            for number in range(7)]
+        seen = []
+        url = reverse('polls:index') + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            seen.extend(response.context['latest_question_list'])
+            older_url = response.context['older_url']
+            url = older_url and reverse('polls:index') + older_url
+        self.assertEqual(seen, questions[::-1])
+
+    def test_state_filter(self):
+        """?state= lists only the open or the closed questions."""
+        open_question = create_question("Open.", start=-1, end=3)
+        closed_question = create_question("Closed.", start=-3, end=-1)
+        response = self.client.get(reverse('polls:index') + '?state=open')
+        self.assertEqual(response.context['latest_question_list'],
+                         [open_question])
+        response = self.client.get(reverse('polls:index') + '?state=closed')
+        self.assertEqual(response.context['latest_question_list'],
+                         [closed_question])
+
+    def test_bad_cursor(self):
+        """A cursor that cannot be decoded is a bad request."""
+        response = self.client.get(reverse('polls:index') + '?before=xyz')
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_changelist_does_not_count(self):
+        """The admin question list pages by cursor without COUNT queries."""
+        User.objects.create_superuser('admin', password='admin12345')
+        self.client.login(username='admin', password='admin12345')
+        for number in range(3):
+            create_question(f"Question {number}.", start=-number - 1, end=3)
+        url = reverse('admin:polls_question_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            with patch.object(QuestionAdmin, 'list_per_page', 2):
+                response = self.client.get(url)
+                older = self.client.get(url + response.context['cl'].older_url)
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        self.assertEqual([question.question_text for question
+                          in older.context['cl'].result_list],
+                         ["Question 2."])
+        self.assertFalse(any('COUNT(' in query['sql']
+                             for query in queries.captured_queries))
+
+
+class QuestionDetailViewTests(PollsTestCase):
     def test_future_question(self):
         """
         The detail view of a question with a pub_date in the future
@@ -173,7 +335,7 @@ class QuestionDetailViewTests(TestCase):
         self.assertContains(response, past_question.question_text)
 
 
-class VoteModelTest(TestCase):
+class VoteModelTest(PollsTestCase):
     def setUp(self):
         self.username = "testuser"
         self.password = "test"
@@ -199,3 +361,1018 @@ class VoteModelTest(TestCase):
         vote_url = reverse('polls:vote', args=[self.question.id])
         response = self.client.get(vote_url)
         self.assertEqual(response.status_code, 200)
+
+    def test_upcoming_poll_refuses_votes(self):
+        """Votes posted before a poll opens are not recorded."""
+        choice = self.question.choice_set.create(choice_text="early")
+        self.client.login(username="testuser", password="test")
+        vote_url = reverse('polls:vote', args=[self.question.id])
+        response = self.client.post(vote_url, {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertFalse(Vote.objects.exists())
+
+
+class VoteTallyTests(PollsTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.question = create_question("tally question", start=-1, end=5)
+        self.first = self.question.choice_set.create(choice_text="first")
+        self.second = self.question.choice_set.create(choice_text="second")
+        self.client.login(username="voter", password="test")
+
+    def vote(self, choice):
+        """Post a vote for choice as the logged in user."""
+        return self.client.post(reverse('polls:vote',
+                                        args=(self.question.id,)),
+                                {'choice': choice.id})
+
+    def test_vote_increments_tally(self):
+        """Voting adds one to the tally of the selected choice."""
+        self.vote(self.first)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+
+    def test_change_vote_moves_tally(self):
+        """Changing a vote decrements the old choice."""
+        self.vote(self.first)
+        self.vote(self.second)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(self.second.votes, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_same_vote_twice_counts_once(self):
+        """Voting for the same choice again does not change the tally."""
+        self.vote(self.first)
+        self.vote(self.first)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+
+    def test_one_vote_per_question_is_enforced(self):
+        """The database rejects a second vote row for the same question."""
+        self.vote(self.first)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, choice=self.second)
+
+    def test_deleted_votes_leave_tally(self):
+        """Deleting a vote, or its user, takes it off the tally."""
+        other = User.objects.create_user(username="other", password="test")
+        Vote.objects.cast(other, self.first)
+        self.vote(self.first)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        Vote.objects.get(user=self.user).delete()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        Vote.objects.cast(User.objects.create_user(username="third"),
+                          self.second)
+        self.second.delete()
+        call_command('recount_votes', '--check', stdout=StringIO())
+
+    @override_settings(POLLS_TALLY_SHARDS=4)
+    def test_deleted_votes_leave_sharded_tally(self):
+        """With shards, a deleted vote is taken off through a shard."""
+        self.vote(self.first)
+        self.user.delete()
+        self.assertEqual(Choice.objects.with_tallies().get(
+            pk=self.first.id).votes, 0)
+        call_command('recount_votes', '--check', stdout=StringIO())
+
+    def test_recount_votes_repairs_tallies(self):
+        """recount_votes rebuilds tallies that drifted from the Vote rows."""
+        self.vote(self.first)
+        self.question.choice_set.update(vote_count=7)
+        with self.assertRaises(CommandError):
+            call_command('recount_votes', '--check', stdout=StringIO())
+        call_command('recount_votes', stdout=StringIO())
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+        self.assertEqual(self.second.votes, 0)
+        call_command('recount_votes', '--check', stdout=StringIO())
+
+
+class VotedChoiceTests(PollsTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.question = create_question("voted question", start=-1, end=5)
+        for number in range(10):
+            choice = self.question.choice_set.create(
+                choice_text=f"choice {number}")
+        Vote.objects.cast(self.user, choice)
+        self.choice = choice
+
+    def test_get_voted_choice_is_one_query(self):
+        """get_voted_choice() looks the vote up in a single query."""
+        with self.assertNumQueries(1):
+            voted_choice = self.question.get_voted_choice(self.user)
+        self.assertEqual(voted_choice, self.choice)
+
+    def test_detail_checks_voted_choice(self):
+        """The detail page pre-selects the choice the user voted for."""
+        self.client.login(username="voter", password="test")
+        url = reverse('polls:detail', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.context['check'], self.choice.id)
+        self.assertContains(response, f'value="{self.choice.id}" checked>')
+        self.assertContains(response, ' checked>', count=1)
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertNotContains(response, ' checked>')
+
+
+class QuestionResultsViewTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def results_queries(self, number_of_choices):
+        """Count the queries of the results page for a new question."""
+        question = create_question("results question", start=-1, end=5)
+        for number in range(number_of_choices):
+            question.choice_set.create(choice_text=f"choice {number}",
+                                       vote_count=number)
+        url = reverse('polls:results', args=(question.id,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        return response
+
+    def test_results_query_count_is_fixed(self):
+        """Results cost the same queries for any number of choices."""
+        self.results_queries(3)
+        response = self.results_queries(30)
+        self.assertEqual(len(response.context['choices']), 30)
+
+    def test_results_show_share(self):
+        """Each choice shows its share of the total votes."""
+        response = self.results_queries(3)
+        shares = [choice.share for choice in response.context['choices']]
+        self.assertEqual(shares, [0, 100 / 3, 200 / 3])
+
+
+@override_settings(POLLS_TALLY_SHARDS=4)
+class TallyShardTests(PollsTestCase):
+    def setUp(self):
+        self.question = create_question("hot question", start=-1, end=5)
+        self.hot = self.question.choice_set.create(choice_text="hot")
+        self.cold = self.question.choice_set.create(choice_text="cold")
+        self.users = [User.objects.create_user(username=f"fan{number}")
+                      for number in range(6)]
+
+    def test_votes_go_to_shards(self):
+        """Votes update shard rows and reads add them up."""
+        for user in self.users:
+            Vote.objects.cast(user, self.hot)
+        Vote.objects.cast(self.users[0], self.cold)
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.vote_count, 0)
+        self.assertEqual(ChoiceTallyShard.objects.filter(
+            choice=self.hot).count(), 4)
+        results = self.question.get_results()
+        self.assertEqual([choice.votes for choice in results], [5, 1])
+        call_command('recount_votes', '--check', stdout=StringIO())
+
+    def test_compact_tallies(self):
+        """compact_tallies folds the shards into vote_count."""
+        for user in self.users:
+            Vote.objects.cast(user, self.hot)
+        Vote.objects.cast_many({(self.users[1].id, self.question.id):
+                                self.cold.id})
+        call_command('compact_tallies', stdout=StringIO())
+        self.assertFalse(ChoiceTallyShard.objects.exists())
+        self.assertEqual(
+            list(Choice.objects.order_by('id').values_list(
+                'vote_count', flat=True)), [5, 1])
+
+
+class ResultSnapshotTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="late", password="test")
+        self.question = create_question("closed question", start=-5, end=-1)
+        self.choice = self.question.choice_set.create(choice_text="frozen")
+        Vote.objects.cast(self.user, self.choice)
+
+    def test_closed_results_come_from_snapshot(self):
+        """Results of a closed poll stay as they were when it closed."""
+        url = reverse('polls:results', args=(self.question.id,))
+        self.assertContains(self.client.get(url), "100.0%")
+        self.assertTrue(
+            ResultSnapshot.objects.filter(question=self.question).exists())
+        Choice.objects.filter(pk=self.choice.id).update(vote_count=0)
+        cache.clear()
+        choices = self.client.get(url).context['choices']
+        self.assertEqual([choice.votes for choice in choices], [1])
+
+    def test_open_results_have_no_snapshot(self):
+        """Open polls are tallied live."""
+        question = create_question("open question", start=-1, end=5)
+        question.get_results()
+        self.assertFalse(
+            ResultSnapshot.objects.filter(question=question).exists())
+
+    def test_reopened_poll_takes_new_snapshot(self):
+        """A poll reopened and closed again is not stuck at its old end."""
+        self.question.get_results()
+        self.question.end_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        other = User.objects.create_user(username="reopen", password="test")
+        Vote.objects.cast(other, self.choice)
+        self.question.end_date = timezone.now() - datetime.timedelta(hours=1)
+        self.question.save()
+        choices = self.question.get_results()
+        self.assertEqual([choice.votes for choice in choices], [2])
+        out = StringIO()
+        call_command('close_polls', stdout=out)
+        self.assertIn("Took 0 result snapshots.", out.getvalue())
+
+    def test_close_polls_archives_votes(self):
+        """close_polls snapshots closed polls and moves their votes away."""
+        open_question = create_question("open question", start=-1, end=5)
+        Vote.objects.cast(self.user,
+                          open_question.choice_set.create(choice_text="live"))
+        out = StringIO()
+        call_command('close_polls', '--archive-votes', stdout=out)
+        self.assertIn("Took 1 result snapshots. Archived 1 votes.",
+                      out.getvalue())
+        self.assertEqual(list(Vote.objects.values_list('question', flat=True)),
+                         [open_question.id])
+        self.assertTrue(ArchivedVote.objects.filter(
+            question=self.question, choice=self.choice).exists())
+        call_command('recount_votes', '--check', stdout=StringIO())
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_snapshot_is_taken_from_primary(self):
+        """A replica that is behind cannot freeze stale results."""
+        snapshot = ResultSnapshot.objects.take(self.question)
+        self.assertEqual(snapshot.choices[0]['votes'], 1)
+
+    async def test_async_closed_results(self):
+        """aget_results() takes the snapshot too."""
+        choices = await self.question.aget_results()
+        self.assertEqual([choice.votes for choice in choices], [1])
+        self.assertTrue(await ResultSnapshot.objects.filter(
+            question=self.question).aexists())
+
+
+class ConditionalGetTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="etag", password="test")
+        self.question = create_question("etag question", start=-1, end=5)
+        self.choice = self.question.choice_set.create(choice_text="etag")
+
+    def test_results_not_modified(self):
+        """An unchanged results page is answered by its question alone."""
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_results_etag_follows_votes(self):
+        """A vote gives the results page a new ETag."""
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.choice)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_closed_results_are_cacheable(self):
+        """Closed polls are dated by their end and may be kept by caches."""
+        question = create_question("closed etag", start=-5, end=-1)
+        url = reverse('polls:results', args=(question.id,))
+        response = self.client.get(url)
+        self.assertEqual(response['Last-Modified'],
+                         http_date(question.end_date.timestamp()))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(POLLS_VOTE_BUFFER=True, POLLS_VOTE_BUFFER_INTERVAL=60)
+    def test_unsettled_results_are_revalidated(self):
+        """A closed poll may gain buffered votes until they are written."""
+        question = create_question("settling etag", start=-5, end=0)
+        question.end_date = timezone.now() - datetime.timedelta(seconds=1)
+        question.save()
+        response = self.client.get(reverse('polls:results',
+                                           args=(question.id,)))
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_closed_poll_refuses_votes(self):
+        """Votes on a closed poll are not counted."""
+        question = create_question("closed vote", start=-5, end=-1)
+        choice = question.choice_set.create(choice_text="late")
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertFalse(Vote.objects.filter(question=question).exists())
+
+    def test_detail_not_modified(self):
+        """An unchanged detail page is answered without reading choices."""
+        self.client.force_login(self.user)
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.client.get(url)  # sets the CSRF cookie the ETag depends on
+        response = self.client.get(url)
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn('Cookie', response['Vary'])
+        self.assertIn('private', response['Cache-Control'])
+        # session, user, question and the user's vote
+        with self.assertNumQueries(4):
+            response = self.client.get(url,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_etag_ignores_other_votes(self):
+        """Votes of others keep the detail page; the user's own changes it."""
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.client.force_login(self.user)
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        other = User.objects.create_user(username="other", password="test")
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(other, self.choice)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.choice)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, f'value="{self.choice.id}" checked>')
+        self.choice.choice_text = "renamed"
+        self.choice.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, "renamed")
+
+    def test_detail_etag_is_per_user(self):
+        """Users get different ETags for the same detail page."""
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.client.force_login(self.user)
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        other = User.objects.create_user(username="other", password="test")
+        self.client.force_login(other)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_async_results_not_modified(self):
+        """The async results page answers 304 too."""
+        request = AsyncRequestFactory().get('/')
+        request.user = AnonymousUser()
+        response = await AsyncResultsView.as_view()(request,
+                                                    pk=self.question.id)
+        request = AsyncRequestFactory().get(
+            '/', headers={'If-None-Match': response['ETag']})
+        request.user = AnonymousUser()
+        response = await AsyncResultsView.as_view()(request,
+                                                    pk=self.question.id)
+        self.assertEqual(response.status_code, 304)
+
+
+class VoteBufferTests(PollsTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.question = create_question("buffer question", start=-1, end=5)
+        self.first = self.question.choice_set.create(choice_text="first")
+        self.second = self.question.choice_set.create(choice_text="second")
+
+    def test_buffer_keeps_last_vote(self):
+        """Only the last buffered vote of a user on a question is written."""
+        buffer = VoteBuffer(size=10, interval=3600)
+        buffer.add(self.user.id, self.question.id, self.first.id)
+        buffer.add(self.user.id, self.question.id, self.second.id)
+        self.assertEqual(Vote.objects.count(), 0)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.question.get_voted_choice(self.user),
+                         self.second)
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.votes, 1)
+
+    def test_buffer_flushes_when_full(self):
+        """The buffer is written once it holds size votes."""
+        buffer = VoteBuffer(size=1, interval=3600)
+        buffer.add(self.user.id, self.question.id, self.first.id)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_failed_flush_keeps_votes(self):
+        """A failed write is logged, not raised, and retried later."""
+        buffer = VoteBuffer(size=1, interval=3600)
+        with patch.object(Vote.objects, 'cast_many',
+                          side_effect=DatabaseError("down")), \
+                self.assertLogs('polls.buffer', 'ERROR'):
+            buffer.add(self.user.id, self.question.id, self.first.id)
+        self.assertIsNotNone(buffer.timer)
+        buffer.timer.cancel()
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_replay_journal(self):
+        """Votes journaled by a stopped process are written by the replay."""
+        with tempfile.TemporaryDirectory() as journal_dir:
+            buffer = VoteBuffer(size=10, interval=3600,
+                                durability='journal', journal_dir=journal_dir)
+            buffer.add(self.user.id, self.question.id, self.first.id)
+            buffer.timer.cancel()
+            buffer.journal.close()
+            self.assertEqual(replay_journals(journal_dir), (1, 1))
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+
+    @override_settings(POLLS_VOTE_BUFFER=True)
+    def test_vote_view_uses_buffer(self):
+        """With POLLS_VOTE_BUFFER on, the vote view only buffers the vote."""
+        self.client.login(username="voter", password="test")
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': self.first.id})
+        self.assertEqual(Vote.objects.count(), 0)
+        get_vote_buffer().flush()
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+class ResultsCacheTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        results_stats.reset()
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.question = create_question("cached question", start=-1, end=5)
+        self.choice = self.question.choice_set.create(choice_text="only")
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def test_results_are_cached(self):
+        """A second visit reads the tallies from the cache."""
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        self.assertEqual(results_stats.as_dict()['hits'], 1)
+        self.assertEqual(results_stats.as_dict()['misses'], 1)
+
+    def test_process_local_cache_is_reported(self):
+        """check --deploy warns when workers cannot share results versions."""
+        self.assertEqual([warning.id for warning in check_shared_cache(None)],
+                         ['polls.W001'])
+        with tempfile.TemporaryDirectory() as location:
+            with self.settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.'
+                               'FileBasedCache',
+                    'LOCATION': location}}):
+                self.assertEqual(check_shared_cache(None), [])
+
+    def test_vote_bumps_version(self):
+        """A vote makes the next visit read the new tallies."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.choice)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['choices'][0].votes, 1)
+
+    @override_settings(POLLS_RESULTS_STALENESS=60)
+    def test_staleness_budget_serves_old_results(self):
+        """Within the staleness budget, older tallies are served."""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.choice)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['choices'][0].votes, 0)
+        self.assertEqual(results_stats.as_dict()['stale_hits'], 1)
+
+    def test_results_table_fragment(self):
+        """The results table is cached until the results version changes."""
+        self.client.get(self.url)
+        Choice.objects.update(vote_count=7)
+        key, _ = results_keys(self.question.id,
+                              get_results_version(self.question.id))
+        cache.delete(key)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['choices'][0].votes, 7)
+        self.assertContains(response, f'id="votes{self.choice.id}">0<')
+        bump_results_version(self.question.id)
+        response = self.client.get(self.url)
+        self.assertContains(response, f'id="votes{self.choice.id}">7<')
+
+
+class AsyncViewTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question("async question", start=-1, end=5)
+        self.choice = self.question.choice_set.create(choice_text="async",
+                                                      vote_count=3)
+
+    def request(self):
+        """Return an anonymous GET request for the async views."""
+        request = AsyncRequestFactory().get('/')
+        request.user = AnonymousUser()
+        return request
+
+    async def test_async_index(self):
+        """The async index lists the published question."""
+        response = await AsyncIndexView.as_view()(self.request())
+        self.assertContains(response, "async question")
+
+    async def test_async_detail(self):
+        """The async detail page shows the choices."""
+        response = await AsyncDetailView.as_view()(self.request(),
+                                                   pk=self.question.id)
+        self.assertContains(response, 'value="%d"' % self.choice.id)
+
+    async def test_async_results(self):
+        """The async results page shows the tallies."""
+        response = await AsyncResultsView.as_view()(self.request(),
+                                                    pk=self.question.id)
+        self.assertContains(response, "100.0%")
+
+
+@override_settings(POLLS_RESULTS_STREAM=True, POLLS_STREAM_INTERVAL=0,
+                   POLLS_STREAM_HEARTBEAT=0.01, POLLS_STREAM_DURATION=60)
+class ResultsStreamTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.question = create_question("live question", start=-1, end=5)
+        self.choice = self.question.choice_set.create(choice_text="live")
+
+    def test_stream_view_sends_events(self):
+        """The stream endpoint answers with an event stream."""
+        url = reverse('polls:results-stream', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content
+        self.assertTrue(next(events).startswith(b"retry:"))
+        self.assertIn(b"event: results", next(events))
+        response.close()
+
+    def test_stream_can_be_turned_off(self):
+        """Without POLLS_RESULTS_STREAM no page opens a stream."""
+        results = reverse('polls:results', args=(self.question.id,))
+        self.assertContains(self.client.get(results), "EventSource")
+        with self.settings(POLLS_RESULTS_STREAM=False):
+            cache.clear()
+            self.assertNotContains(self.client.get(results), "EventSource")
+            url = reverse('polls:results-stream', args=(self.question.id,))
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_votes_are_coalesced(self):
+        """Many votes between two updates produce a single event."""
+        events = stream_results(self.question)
+        next(events)
+        self.assertIn('"votes": 0', next(events))
+        other = User.objects.create_user(username="other", password="test")
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.choice)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(other, self.choice)
+        self.assertIn('"votes": 2', next(events))
+        self.assertEqual(next(events), ": keep-alive\n\n")
+
+    def test_broker_wakes_waiting_stream(self):
+        """publish() ends the wait of a stream on the same question."""
+        broker = ResultsBroker()
+        seen = broker.seen(1)
+        broker.publish(1)
+        self.assertEqual(broker.wait(1, seen, timeout=1), seen + 1)
+
+
+class ResultsBatchTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.questions = [create_question(f"question {number}", start=-1,
+                                          end=5) for number in range(4)]
+        for question in self.questions:
+            choice = question.choice_set.create(choice_text="yes")
+            question.choice_set.create(choice_text="no")
+        Vote.objects.cast(self.user, choice)
+        self.url = reverse('polls:results-batch')
+
+    def get_ids(self, ids):
+        return self.client.get(self.url, {'ids': ','.join(map(str, ids))})
+
+    def test_results_in_order_asked(self):
+        """Results come in the order of the ids, with votes and shares."""
+        ids = [question.id for question in reversed(self.questions)]
+        data = self.get_ids(ids).json()
+        self.assertEqual([result['question'] for result in data['results']],
+                         ids)
+        self.assertEqual(data['results'][0]['total'], 1)
+        self.assertEqual(data['results'][0]['choices'][0]['share'], 100.0)
+        self.assertEqual(data['missing'], [])
+
+    def test_fixed_number_of_queries(self):
+        """Any number of questions in a chunk costs the same two queries."""
+        ids = [question.id for question in self.questions]
+        with self.assertNumQueries(2):
+            self.get_ids(ids[:1])
+        with self.assertNumQueries(2):
+            self.get_ids(ids)
+
+    def test_missing_and_unpublished(self):
+        """Unknown and future questions are listed as missing."""
+        future = create_question("future question", start=5, end=10)
+        data = self.get_ids([self.questions[0].id, future.id, 999]).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['missing'], [future.id, 999])
+
+    def test_closed_results_come_from_snapshot(self):
+        """Closed questions are read from, or frozen into, their snapshot."""
+        closed = create_question("closed question", start=-5, end=-1)
+        closed.choice_set.create(choice_text="done", vote_count=3)
+        data = self.get_ids([closed.id]).json()
+        self.assertEqual(data['results'][0]['total'], 3)
+        self.assertTrue(
+            ResultSnapshot.objects.filter(question=closed).exists())
+        Choice.objects.filter(question=closed).update(vote_count=0)
+        self.assertEqual(self.get_ids([closed.id]).json()['results'][0]
+                         ['total'], 3)
+
+    def test_bad_ids(self):
+        """Missing, non-numeric and too many ids are rejected."""
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.get_ids(['one']).status_code, 400)
+        with override_settings(POLLS_RESULTS_BATCH_MAX_IDS=2):
+            self.assertEqual(self.get_ids([1, 2, 3]).status_code, 400)
+
+    @override_settings(POLLS_RESULTS_BATCH_CHUNK=1)
+    def test_long_lists_are_streamed(self):
+        """Lists longer than a chunk stream a valid JSON document."""
+        ids = [question.id for question in self.questions] + [999]
+        response = self.get_ids(ids)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([result['question'] for result in data['results']],
+                         ids[:-1])
+        self.assertEqual(data['missing'], [999])
+
+
+class ReadReplicaTests(PollsTestCase):
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_reads_go_to_replicas(self):
+        """Reads use a replica unless pinned, writes the primary."""
+        self.assertEqual(self.router.db_for_read(Question), 'replica1')
+        with pin_primary():
+            self.assertEqual(self.router.db_for_read(Question), 'default')
+        self.assertEqual(self.router.db_for_write(Question), 'default')
+        self.assertIs(self.router.allow_migrate('replica1', 'polls'), False)
+
+    def test_no_replicas(self):
+        """Without replicas everything uses the default database."""
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaStickinessMiddleware(HttpResponse)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'],
+                       POLLS_REPLICA_STICKY_SECONDS=7)
+    def test_write_pins_the_next_requests(self):
+        """After a POST the browser reads from the primary for a while."""
+        used = []
+
+        def view(request):
+            used.append(self.router.db_for_read(Question))
+            return HttpResponse()
+
+        middleware = ReplicaStickinessMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get('/'))
+        response = middleware(factory.post('/'))
+        cookie = response.cookies[ReplicaStickinessMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], 7)
+        request = factory.get('/')
+        request.COOKIES[cookie.key] = cookie.value
+        middleware(request)
+        self.assertEqual(used, ['replica1', 'default', 'default'])
+
+    def test_commands_read_from_primary(self):
+        """Commands that write tallies never count the rows of a replica."""
+        user = User.objects.create_user(username="voter", password="test")
+        question = create_question("replicated question", start=-1, end=5)
+        choice = question.choice_set.create(choice_text="yes")
+        Vote.objects.cast(user, choice)
+        Choice.objects.filter(pk=choice.id).update(vote_count=5)
+        read_from = []
+        db_for_read = ReadReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            read_from.append(db_for_read(router, model, **hints))
+            return read_from[-1]
+
+        with self.settings(DATABASE_REPLICAS=['replica1']), \
+                patch.object(ReadReplicaRouter, 'db_for_read', record):
+            for command in ('recount_votes', 'close_polls', 'rollup_votes',
+                            'compact_tallies'):
+                call_command(command, stdout=StringIO())
+        self.assertEqual(Choice.objects.get(pk=choice.id).vote_count, 1)
+        self.assertTrue(read_from)
+        self.assertEqual(set(read_from), {'default'})
+
+
+class DatabaseProfileTests(PollsTestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_sqlite_pragmas_are_applied(self):
+        """New SQLite connections get the SQLITE_PRAGMAS."""
+        old_timeout = self.pragma('busy_timeout')
+        with self.settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            tune_sqlite(sender=None, connection=connection)
+        self.assertEqual(self.pragma('busy_timeout'), 1234)
+        with self.settings(SQLITE_PRAGMAS={'busy_timeout': old_timeout}):
+            tune_sqlite(sender=None, connection=connection)
+
+
+class VoteAnalyticsTests(PollsTestCase):
+    def setUp(self):
+        self.question = create_question("timed question", start=-5, end=5)
+        self.yes = self.question.choice_set.create(choice_text="yes")
+        self.no = self.question.choice_set.create(choice_text="no")
+        self.hour = (timezone.now() - datetime.timedelta(days=2)).replace(
+            minute=0, second=0, microsecond=0)
+        self.users = [User.objects.create_user(username=f"voter{number}")
+                      for number in range(3)]
+        for user, choice, minutes in ((self.users[0], self.yes, 5),
+                                      (self.users[1], self.no, 40),
+                                      (self.users[2], self.yes, 70)):
+            vote = Vote.objects.cast(user, choice)
+            Vote.objects.filter(pk=vote.pk).update(
+                cast_at=self.hour + datetime.timedelta(minutes=minutes))
+
+    def hourly(self):
+        """Return hour rollups as (minutes from self.hour, choice, votes)."""
+        return sorted(
+            ((start - self.hour).total_seconds() // 60, choice, votes)
+            for start, choice, votes in VoteRollup.objects.filter(
+                period=HOUR).values_list('start', 'choice', 'votes'))
+
+    def test_votes_record_times(self):
+        """Votes know when they were cast and when they were changed."""
+        vote = Vote.objects.cast(self.users[0], self.no)
+        self.assertIsNotNone(vote.cast_at)
+        self.assertIsNotNone(vote.changed_at)
+
+    def test_created_votes_get_a_time(self):
+        """Votes written without cast() are counted in the current bucket."""
+        user = User.objects.create_user(username="direct")
+        vote = Vote.objects.create(user=user, choice=self.no,
+                                   question=self.question)
+        self.assertIsNotNone(vote.cast_at)
+        update_rollups()
+        self.assertEqual(VoteRollup.objects.filter(
+            period=HOUR, start=truncate(vote.cast_at, HOUR)).get().votes, 1)
+
+    def test_rollups_read_from_primary(self):
+        """update_rollups() does not count the votes of a replica."""
+        with self.settings(DATABASE_REPLICAS=['replica1']):
+            update_rollups()
+        self.assertEqual(len(self.hourly()), 3)
+
+    def test_rollups_count_votes_per_bucket(self):
+        """Rollups count the votes of each choice per hour and minute."""
+        update_rollups()
+        self.assertEqual(self.hourly(), [(0, self.yes.id, 1),
+                                         (0, self.no.id, 1),
+                                         (60, self.yes.id, 1)])
+        self.assertEqual(VoteRollup.objects.filter(
+            period=MINUTE).count(), 3)
+
+    def test_rollups_follow_changed_votes(self):
+        """A changed vote is counted again in the bucket it was cast in."""
+        update_rollups()
+        Vote.objects.cast(self.users[0], self.no)
+        self.assertEqual(self.hourly()[0], (0, self.yes.id, 1))
+        update_rollups()
+        self.assertEqual(self.hourly(), [(0, self.no.id, 2),
+                                         (60, self.yes.id, 1)])
+
+    def test_only_touched_buckets_are_read(self):
+        """Adjacent buckets share a range; the ones between are not read."""
+        hour = datetime.timedelta(hours=1)
+        starts = [self.hour, self.hour + hour, self.hour + 5 * hour]
+        self.assertEqual(spans(HOUR, starts), [
+            (self.hour, self.hour + 2 * hour),
+            (self.hour + 5 * hour, self.hour + 6 * hour)])
+        counts = count_buckets(self.question.id, HOUR,
+                               [self.hour + hour, self.hour + 5 * hour])
+        self.assertEqual(dict(counts), {(self.yes.id, self.hour + hour): 1})
+
+    def test_turnout_chart(self):
+        """Staff can chart the votes of a question over time."""
+        update_rollups()
+        User.objects.create_superuser('admin', password='admin12345')
+        self.client.login(username='admin', password='admin12345')
+        response = self.client.get(reverse(
+            'admin:polls_question_turnout', args=(self.question.id,)))
+        self.assertEqual([row['total'] for row in response.context['rows']],
+                         [2, 1])
+
+
+class SearchTests(PollsTestCase):
+    def check_search(self):
+        """Search by question and choice words, prefixes, and deletes."""
+        question = create_question("Favourite programming language?",
+                                   start=-1, end=3)
+        choice = question.choice_set.create(choice_text="Python")
+        create_question("Favourite food?", start=-1, end=3)
+
+        def found(text):
+            return list(search_filter(Question.objects.all(), text))
+
+        self.assertEqual(found("programming"), [question])
+        self.assertEqual(found("favourite PYTH"), [question])
+        self.assertEqual(found("food python"), [])
+        self.assertEqual(found("!!"), [])
+        choice.choice_text = "Rust"
+        choice.save()
+        self.assertEqual(found("python"), [])
+        self.assertEqual(found("rust"), [question])
+        question.delete()
+        self.assertEqual(found("programming"), [])
+
+    def test_fts5_search(self):
+        """SQLite searches through the FTS5 table."""
+        self.assertIs(uses_fts(), True)
+        self.check_search()
+
+    @override_settings(POLLS_SEARCH_BACKEND='terms')
+    def test_search_terms_fallback(self):
+        """Without FTS5 the SearchTerm rows give the same results."""
+        self.assertIs(uses_fts(), False)
+        self.check_search()
+
+    def test_search_view_lists_published_questions(self):
+        """The search page does not show questions that are not published."""
+        question = create_question("Best season?", start=-1, end=3)
+        create_question("Best season next year?", start=1, end=3)
+        response = self.client.get(reverse('polls:search'), {'q': 'season'})
+        self.assertEqual(response.context['latest_question_list'],
+                         [question])
+
+    def test_admin_search_uses_index(self):
+        """Admin search filters through the index instead of LIKE."""
+        User.objects.create_superuser('admin', password='admin12345')
+        self.client.login(username='admin', password='admin12345')
+        create_question("Best season?", start=-1, end=3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:polls_question_changelist'), {'q': 'season'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        self.assertFalse(any('LIKE' in query['sql']
+                             for query in queries.captured_queries))
+
+
+class QueryPlanTests(PollsTestCase):
+    def test_hot_queries_use_indexes(self):
+        """No hot query of the polls app reads a whole table."""
+        call_command('check_query_plans', stdout=StringIO())
+
+    def test_full_scan_is_found(self):
+        """A filter on a column without an index is reported."""
+        queryset = Choice.objects.filter(choice_text="no index")
+        self.assertEqual(full_scans(queryset), ['polls_choice'])
+
+
+class TransferTests(PollsTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="voter",
+                                             password="test")
+        self.question = create_question("exported question", start=-1, end=5)
+        self.choice = self.question.choice_set.create(choice_text="kept")
+        Vote.objects.cast(self.user, self.choice)
+
+    def test_jsonl_round_trip(self):
+        """Exported rows are imported back with the same pks and tallies."""
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as file:
+            call_command('export_polls', file.name, stderr=StringIO())
+            User.objects.all().delete()
+            Question.objects.all().delete()
+            call_command('import_polls', file.name, stdout=StringIO(),
+                         stderr=StringIO())
+        choice = Choice.objects.get(pk=self.choice.id)
+        self.assertEqual(choice.votes, 1)
+        self.assertEqual(choice.question.question_text, "exported question")
+        self.assertTrue(User.objects.get(pk=self.user.id).check_password(
+            "test"))
+
+    def test_archived_votes_are_counted(self):
+        """Imported tallies count archived votes like recount_votes."""
+        ArchivedVote.objects.archive([self.question.id])
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as file:
+            call_command('export_polls', file.name, '--model',
+                         'polls.archivedvote', stderr=StringIO())
+            Choice.objects.filter(pk=self.choice.id).update(vote_count=0)
+            ArchivedVote.objects.all().delete()
+            call_command('import_polls', file.name, stdout=StringIO(),
+                         stderr=StringIO())
+        self.assertEqual(Choice.objects.get(pk=self.choice.id).votes, 1)
+        call_command('recount_votes', '--check', stdout=StringIO())
+
+    def test_csv_votes_without_question(self):
+        """Votes from a CSV file without a question column get one."""
+        Vote.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write(f"pk,choice,user\n7,{self.choice.id},{self.user.id}\n")
+            file.flush()
+            call_command('import_polls', file.name, '--model', 'polls.vote',
+                         stdout=StringIO(), stderr=StringIO())
+        vote = Vote.objects.get(pk=7)
+        self.assertEqual(vote.question, self.question)
+        # imported votes without a time stay out of the turnout charts
+        self.assertIsNone(vote.cast_at)
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, 1)
+
+    def test_json_array_is_read_in_chunks(self):
+        """Records split across chunks are parsed whole."""
+        stream = StringIO('[{"a": "x, y"}, {"b": [1, 2]}]')
+        records = list(read_json_array(stream, chunk_size=4))
+        self.assertEqual(records, [{"a": "x, y"}, {"b": [1, 2]}])
+
+
+class BenchmarkHelperTests(PollsTestCase):
+    def test_percentiles_nearest_rank(self):
+        """percentiles() picks samples by the nearest-rank method."""
+        samples = list(range(1, 101))
+        self.assertEqual(percentiles(samples),
+                         {'p50': 50, 'p95': 95, 'p99': 99})
+        self.assertEqual(percentiles([7])['p99'], 7)
+
+
+@override_settings(POLLS_METRICS=True)
+class RequestMetricsTests(PollsTestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.question = create_question("measured question", start=-1, end=5)
+        self.question.choice_set.create(choice_text="measured")
+
+    def test_server_timing_header(self):
+        """Responses carry the database, template and total time."""
+        response = self.client.get(reverse('polls:results',
+                                           args=(self.question.id,)))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        self.assertIn('template;dur=', response['Server-Timing'])
+
+    def test_metrics_endpoint_reports_views(self):
+        """Staff can read the recorded metrics of each view."""
+        self.client.get(reverse('polls:results', args=(self.question.id,)))
+        User.objects.create_user(username="staff", password="test",
+                                 is_staff=True)
+        self.client.login(username="staff", password="test")
+        data = self.client.get(reverse('polls:metrics')).json()
+        results = data['views']['polls:results']
+        self.assertEqual(results['requests'], 1)
+        self.assertEqual(results['queries']['p50'], 2)
+        self.assertGreater(results['template_ms']['p50'], 0)
+
+    def test_metrics_endpoint_needs_staff(self):
+        """Anonymous users are sent to the login page."""
+        response = self.client.get(reverse('polls:metrics'))
+        self.assertEqual(response.status_code, 302)
+
+
+class RepeatedQueryTests(PollsTestCase):
+    def setUp(self):
+        self.question = create_question("repeated question", start=-1, end=5)
+        for number in range(5):
+            self.question.choice_set.create(choice_text=f"choice {number}")
+
+    def test_fingerprint_ignores_values(self):
+        """Queries that differ only in their values have one fingerprint."""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND n = 1"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s) AND n = 22"))
+
+    def test_n_plus_one_is_reported(self):
+        """A query per row is reported with the line that ran it."""
+        with self.assertRaises(RepeatedQueriesError) as raised:
+            with detect_repeated_queries(threshold=3):
+                for choice in Choice.objects.all():
+                    choice.question
+        self.assertIn("5x from", str(raised.exception))
+        self.assertIn("test.py", str(raised.exception))
+
+    def test_template_line_is_reported(self):
+        """A query run by a template names the template and its line."""
+        template = Template("{% for c in choices %}{{ c.question }}"
+                            "{% endfor %}")
+        with self.assertRaises(RepeatedQueriesError) as raised:
+            with detect_repeated_queries(threshold=3):
+                template.render(Context({'choices': Choice.objects.all()}))
+        self.assertIn("template <unknown source>:1", str(raised.exception))
+
+    def test_views_do_not_repeat_queries(self):
+        """The results page of a question with many choices passes."""
+        url = reverse('polls:results', args=(self.question.id,))
+        self.assertEqual(self.client.get(url).status_code, 200)
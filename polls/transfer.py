@@ -0,0 +1,258 @@
+"""Streaming import and export of users, questions, choices and votes.
+
+Records have the shape of Django fixture objects (``{"model": ..., "pk": ...,
+"fields": {...}}``) and are read and written one at a time, so memory use
+does not grow with the size of the file. Supported formats:
+
+* ``jsonl``: one record per line, any mix of models.
+* ``csv``: one model per file, a ``pk`` column and one column per field.
+* ``json``: a fixture array like ``data/polls.json``, parsed incrementally
+  (import only).
+"""
+import csv
+import json
+import time
+
+from django.apps import apps
+from django.core import serializers
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Deserializer
+from django.db import connection, transaction
+
+from .models import (ArchivedVote, Choice, Question, Vote,
+                     send_tallies_changed)
+from .search import index_questions
+
+# in the order that satisfies their foreign keys
+MODEL_LABELS = ['auth.user', 'polls.question', 'polls.choice', 'polls.vote',
+                'polls.archivedvote']
+FORMATS = ('jsonl', 'csv', 'json')
+
+
+def get_model(label):
+    """Return the model of a label from MODEL_LABELS."""
+    if label.lower() not in MODEL_LABELS:
+        raise ValueError(f"Cannot transfer {label}; use one of "
+                         f"{', '.join(MODEL_LABELS)}.")
+    return apps.get_model(label)
+
+
+def field_names(model):
+    """Return the names of the fields that are transferred for a model."""
+    return [field.name for field in model._meta.concrete_fields
+            if not field.primary_key]
+
+
+def read_jsonl(stream):
+    """Yield the records of a JSON Lines stream."""
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json_array(stream, chunk_size=1 << 16):
+    """Yield the elements of a JSON array without loading the whole array."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: stream.read(chunk_size), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("A JSON fixture must be an array.")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # the record continues in the next chunk
+            yield record
+        buffer = buffer[position:]
+
+
+def read_csv(stream, label):
+    """Yield the rows of a CSV stream as records of model label."""
+    model = get_model(label)
+    nullable = {field.name for field in model._meta.concrete_fields
+                if field.null}
+    for row in csv.DictReader(stream):
+        pk = row.pop('pk')
+        yield {
+            'model': label,
+            'pk': pk,
+            'fields': {name: None if value == '' and name in nullable
+                       else value for name, value in row.items()},
+        }
+
+
+def read_records(stream, format, label=None):
+    """Yield the records of stream in the given format."""
+    if format == 'jsonl':
+        return read_jsonl(stream)
+    if format == 'json':
+        return read_json_array(stream)
+    if label is None:
+        raise ValueError("A CSV file holds one model; give its label.")
+    return read_csv(stream, label)
+
+
+class Progress:
+    """Report rows and rows per second every few seconds."""
+
+    def __init__(self, write, every=5.0):
+        self.write = write
+        self.every = every
+        self.started = self.reported = time.monotonic()
+        self.rows = 0
+
+    def add(self, rows):
+        """Count rows and report if it is time to."""
+        self.rows += rows
+        now = time.monotonic()
+        if now - self.reported >= self.every:
+            self.reported = now
+            self.write(self.summary())
+
+    def summary(self):
+        """Return the rows so far and the average throughput."""
+        seconds = max(time.monotonic() - self.started, 1e-9)
+        return (f"{self.rows} rows in {seconds:.1f}s "
+                f"({self.rows / seconds:.0f} rows/s)")
+
+
+class Importer:
+    """Save records in batches with bulk_create, keeping their pks."""
+
+    def __init__(self, batch_size=2000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.batches = {label: [] for label in MODEL_LABELS}
+        self.models = set()
+        self.voted_questions = set()
+        self.indexed_questions = set()
+
+    def add(self, records):
+        """Import an iterable of records."""
+        checked = (record for record in records if get_model(record['model']))
+        for deserialized in Deserializer(checked, ignorenonexistent=True):
+            label = deserialized.object._meta.label_lower
+            self.batches[label].append(deserialized.object)
+            if len(self.batches[label]) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write all pending batches, parents before children."""
+        with transaction.atomic():
+            for label in MODEL_LABELS:
+                objects, self.batches[label] = self.batches[label], []
+                if not objects:
+                    continue
+                model = apps.get_model(label)
+                if model is Vote:
+                    self.fill_vote_questions(objects)
+                elif model is ArchivedVote:
+                    self.voted_questions.update(
+                        vote.question_id for vote in objects)
+                model.objects.bulk_create(objects, batch_size=500)
+                if model is Question:
+                    self.indexed_questions.update(
+                        question.pk for question in objects)
+                elif model is Choice:
+                    self.indexed_questions.update(
+                        choice.question_id for choice in objects)
+                self.models.add(model)
+                if self.progress:
+                    self.progress.add(len(objects))
+
+    def fill_vote_questions(self, votes):
+        """Set the question of fixture votes that predate Vote.question."""
+        missing = [vote for vote in votes if vote.question_id is None]
+        questions = dict(Choice.objects.filter(
+            pk__in={vote.choice_id for vote in missing}).values_list(
+                'id', 'question_id'))
+        for vote in missing:
+            vote.question_id = questions[vote.choice_id]
+        self.voted_questions.update(vote.question_id for vote in votes)
+
+    def finish(self):
+        """Write what is left and bring the derived data up to date.
+
+        Sequences are reset, the tallies recounted and the imported
+        questions indexed for search.
+        """
+        self.flush()
+        sequences = connection.ops.sequence_reset_sql(no_style(),
+                                                      list(self.models))
+        with connection.cursor() as cursor:
+            for sql in sequences:
+                cursor.execute(sql)
+        question_ids = list(self.voted_questions)
+        for start in range(0, len(question_ids), 500):
+            chunk = question_ids[start:start + 500]
+            with transaction.atomic():
+                Choice.objects.filter(question__in=chunk).recount()
+                send_tallies_changed(chunk)
+        question_ids = list(self.indexed_questions)
+        for start in range(0, len(question_ids), 500):
+            with transaction.atomic():
+                index_questions(question_ids[start:start + 500])
+
+
+def export_records(label, batch_size=2000):
+    """Yield the records of every row of model label."""
+    model = get_model(label)
+    fields = field_names(model)
+    queryset = model.objects.order_by('pk')
+    if model is Choice:
+        queryset = queryset.with_tallies()
+    queryset = queryset.iterator(chunk_size=batch_size)
+    while True:
+        chunk = [row for _, row in zip(range(batch_size), queryset)]
+        if not chunk:
+            return
+        if model is Choice:
+            # exported tallies include the shards not compacted yet
+            for choice in chunk:
+                choice.vote_count = choice.votes
+        yield from serializers.serialize('python', chunk, fields=fields)
+
+
+def write_jsonl(stream, records):
+    """Write records as JSON Lines and return how many were written."""
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, cls=DjangoJSONEncoder))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def write_csv(stream, label, records):
+    """Write records of model label as CSV and return how many were written."""
+    fields = field_names(get_model(label))
+    writer = csv.writer(stream)
+    writer.writerow(['pk', *fields])
+    encoder = DjangoJSONEncoder()
+    count = 0
+    for record in records:
+        values = []
+        for name in fields:
+            value = record['fields'][name]
+            if value is None:
+                value = ''
+            elif not isinstance(value, (str, int, bool)):
+                value = encoder.default(value)
+            values.append(value)
+        writer.writerow([record['pk'], *values])
+        count += 1
+    return count
@@ -1,12 +1,26 @@
-
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.POLLS_ASYNC_VIEWS:
+    index_view = views.AsyncIndexView.as_view()
+    detail_view = views.AsyncDetailView.as_view()
+    results_view = views.AsyncResultsView.as_view()
+else:
+    index_view = views.IndexView.as_view()
+    detail_view = views.DetailView.as_view()
+    results_view = views.ResultsView.as_view()
+
 app_name = 'polls'
 urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('', index_view, name='index'),
+    path('<int:pk>/', detail_view, name='detail'),
+    path('<int:pk>/results/', results_view, name='results'),
+    path('<int:pk>/results/stream/', views.results_stream,
+         name='results-stream'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('results/', views.results_batch, name='results-batch'),
+    path('search/', views.search, name='search'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
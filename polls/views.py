@@ -1,15 +1,80 @@
 
 """This module contains the view of site page of the KU Polls application."""
-from django.http import HttpResponseRedirect
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from django.views import generic
-from .models import Question, Choice, Vote
+from .buffer import get_vote_buffer
+from .cache import (aget_index_page, aget_question_version,
+                    aget_results_version, aget_versioned_results,
+                    get_index_page, get_question_version, get_results_version,
+                    get_versioned_results, index_queryset, results_stats)
+from .events import astream_results, results_data, stream_results
+from .metrics import registry
+from .models import (CLOSED, OPEN, Question, Choice, ResultSnapshot, Vote,
+                     add_shares, settle_time)
+from .pagination import decode_cursor, keyset_page
+from .search import search_filter
 from django.utils import timezone
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 
 
+def index_params(request):
+    """Return the state, cursor and page size asked for the index.
+
+    Raise BadRequest for values that are not understood.
+    """
+    state = request.GET.get('state') or None
+    if state not in (None, OPEN, CLOSED):
+        raise BadRequest(f"Unknown state {state!r}.")
+    cursor = request.GET.get('before') or None
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except ValueError as exc:
+            raise BadRequest(str(exc))
+    page_size = request.GET.get('page_size') or None
+    if page_size is not None:
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise BadRequest(f"Invalid page size {page_size!r}.")
+        page_size = max(1, min(page_size, settings.POLLS_INDEX_MAX_PAGE_SIZE))
+    return state, cursor, page_size
+
+
+def index_context(questions, next_cursor, state, page_size, query=None):
+    """Return the template context of a page of the index or a search."""
+    params = {'q': query, 'state': state, 'page_size': page_size}
+    params = {name: value for name, value in params.items() if value}
+    older_url = None
+    if next_cursor:
+        older_url = '?' + urlencode({**params, 'before': next_cursor})
+    return {
+        "latest_question_list": questions,
+        "query": query,
+        "state": state,
+        "older_url": older_url,
+        "newest_url": '?' + urlencode(params),
+    }
+
+
 class IndexView(generic.ListView):
     """View for index.html"""
     template_name = 'polls/index.html'
@@ -17,12 +82,21 @@ class IndexView(generic.ListView):
 
     def get_queryset(self):
         """
-        Return the last five published questions (not including those set to be
-        published in the future).
+        Return a page of the published questions (not including those set to
+        be published in the future), newest first.
         """
-        return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        ).order_by('-pub_date')[:5]
+        state, cursor, self.page_size = index_params(self.request)
+        self.state = state
+        questions, self.next_cursor = get_index_page(state, cursor,
+                                                     self.page_size)
+        return questions
+
+    def get_context_data(self, **kwargs):
+        """Add the links to the older questions and the filters."""
+        context = super().get_context_data(**kwargs)
+        context.update(index_context(self.object_list, self.next_cursor,
+                                     self.state, self.page_size))
+        return context
 
 
 class DetailView(generic.DetailView):
@@ -34,7 +108,7 @@ class DetailView(generic.DetailView):
         """
         Excludes any questions that aren't published yet.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.published(timezone.now())
 
     def get(self, request, *args, **kwargs):
         """Check if the question is in polling period.
@@ -48,22 +122,23 @@ class DetailView(generic.DetailView):
         except Question.DoesNotExist:
             messages.error(request, "This poll does not exists.")
             return HttpResponseRedirect(reverse('polls:index'))
-        if not question.is_published():
+        now = timezone.now()
+        if not question.is_published(now):
             messages.error(request, "This poll is not publish.")
             return HttpResponseRedirect(reverse('polls:index'))
-        try:
-            current_vote = Vote.objects.get(user=request.user,
-                                            choice__in=question.
-                                            choice_set.all())
-            check = current_vote.choice.choice_text
-        except (Vote.DoesNotExist, TypeError):
-            check = ""
-        if question.can_vote():
-            return render(request, 'polls/detail.html',
-                          {"question": question, "check": check})
-        else:
+        if not question.can_vote(now):
             messages.error(request, 'This poll is over.')
             return HttpResponseRedirect(reverse('polls:index'))
+        version = get_question_version(question.id)
+        voted_choice = question.get_voted_choice(request.user)
+        check = voted_choice.id if voted_choice else None
+        etag = detail_etag(request, question, version, check)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = render(request, 'polls/detail.html', question_context(
+                question, version, choices=question.choice_set.all(),
+                check=check))
+        return detail_headers(response, etag)
 
 
 class ResultsView(generic.DetailView):
@@ -83,34 +158,326 @@ class ResultsView(generic.DetailView):
         except (KeyError, Question.DoesNotExist):
             messages.error(request, "This poll does not exists.")
             return HttpResponseRedirect(reverse('polls:index'))
-        if question.is_published():
-            return render(request, 'polls/results.html',
-                          {"question": question})
-        else:
+        now = timezone.now()
+        if not question.is_published(now):
             messages.error(request, "This poll result is not available.")
             return HttpResponseRedirect(reverse('polls:index'))
+        version = get_results_version(question.id)
+        response = get_conditional_response(
+            request, *results_validators(question, version, now))
+        if response is None:
+            version, choices = get_versioned_results(question)
+            response = render(request, 'polls/results.html', question_context(
+                question, version, choices=choices,
+                live_results=settings.POLLS_RESULTS_STREAM))
+        return results_headers(response, question, version, now)
+
+
+def question_context(question, version, **context):
+    """Return the context of a question page.
+
+    The choice list and the results table are cached template fragments,
+    keyed on the question and version: the question version for the
+    choice list, which shows no tallies, and the results version for the
+    results table. The choice list is also keyed on the checked choice,
+    so it has one copy per choice plus one for users who have not voted.
+    """
+    return {"question": question, "version": version,
+            "fragment_timeout": settings.POLLS_FRAGMENT_CACHE_TIMEOUT,
+            **context}
+
+
+def results_validators(question, version, now):
+    """Return the ETag and Last-Modified time of a results page.
+
+    The ETag follows the results version, which votes and edits of the
+    question bump, and the state of the poll. Final polls also carry the
+    time their last buffered votes were written, after which their
+    results do not change.
+    """
+    state = question.get_state(now)
+    etag = quote_etag(f'results-{question.id}-{version}-{state}')
+    if question.is_final(now):
+        settled = question.end_date + settle_time()
+        return etag, int(settled.timestamp())
+    return etag, None
+
+
+def results_headers(response, question, version, now):
+    """Add the validators and caching rules of a results page to response.
+
+    Results of polls that may still gain votes must be revalidated on
+    every use; those of final polls may be kept by browsers and shared
+    caches.
+    """
+    etag, last_modified = results_validators(question, version, now)
+    response.headers['ETag'] = etag
+    if last_modified is None:
+        patch_cache_control(response, no_cache=True)
+    else:
+        response.headers['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True,
+                            max_age=settings.POLLS_CLOSED_RESULTS_MAX_AGE)
+    return response
+
+
+def detail_etag(request, question, version, check):
+    """Return the weak ETag of the detail page of a question for a user.
+
+    version is the question version, which votes leave alone. The page
+    marks check, the choice the user voted for, and its form holds a token
+    tied to the user's CSRF cookie.
+    """
+    key = ':'.join([str(question.id), str(version), str(request.user.pk),
+                    str(check),
+                    request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')])
+    return 'W/' + quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+
+def detail_headers(response, etag):
+    """Add the ETag and caching rules of a detail page to response."""
+    response.headers['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def load_user(request):
+    """Return request.user after loading it from the session."""
+    request.user.is_authenticated
+    return request.user
+
+
+async def aget_question(pk):
+    """Return the question with primary key pk or raise Http404."""
+    try:
+        return await Question.objects.aget(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404("No Question matches the given query.")
+
+
+class AsyncIndexView(generic.View):
+    """Async version of IndexView for ASGI servers."""
+
+    async def get(self, request, *args, **kwargs):
+        """Render a page of the published questions."""
+        state, cursor, page_size = index_params(request)
+        questions, next_cursor = await aget_index_page(state, cursor,
+                                                       page_size)
+        return await sync_to_async(render)(
+            request, 'polls/index.html',
+            index_context(questions, next_cursor, state, page_size))
+
+
+class AsyncDetailView(generic.View):
+    """Async version of DetailView for ASGI servers."""
+
+    async def get(self, request, *args, **kwargs):
+        """Render the question if it is in polling period."""
+        question = await aget_question(kwargs['pk'])
+        now = timezone.now()
+        if not question.is_published(now):
+            messages.error(request, "This poll is not publish.")
+            return HttpResponseRedirect(reverse('polls:index'))
+        if not question.can_vote(now):
+            messages.error(request, 'This poll is over.')
+            return HttpResponseRedirect(reverse('polls:index'))
+        user = await sync_to_async(load_user)(request)
+        version = await aget_question_version(question.id)
+        voted_choice = await question.aget_voted_choice(user)
+        check = voted_choice.id if voted_choice else None
+        etag = detail_etag(request, question, version, check)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            # the choices are only read when the cached fragment is missing
+            response = await sync_to_async(render)(
+                request, 'polls/detail.html', question_context(
+                    question, version, choices=question.choice_set.all(),
+                    check=check))
+        return detail_headers(response, etag)
+
+
+class AsyncResultsView(generic.View):
+    """Async version of ResultsView for ASGI servers."""
+
+    async def get(self, request, *args, **kwargs):
+        """Render the results of a published question."""
+        question = await aget_question(kwargs['pk'])
+        now = timezone.now()
+        if not question.is_published(now):
+            messages.error(request, "This poll result is not available.")
+            return HttpResponseRedirect(reverse('polls:index'))
+        version = await aget_results_version(question.id)
+        response = get_conditional_response(
+            request, *results_validators(question, version, now))
+        if response is None:
+            version, choices = await aget_versioned_results(question)
+            response = await sync_to_async(render)(
+                request, 'polls/results.html',
+                question_context(question, version, choices=choices,
+                                 live_results=settings.POLLS_RESULTS_STREAM))
+        return results_headers(response, question, version, now)
+
+
+def search(request):
+    """List the published questions whose text or choices match ?q=."""
+    query = request.GET.get('q', '').strip()
+    state, cursor, page_size = index_params(request)
+    questions, next_cursor = [], None
+    if query:
+        questions, next_cursor = keyset_page(
+            search_filter(index_queryset(timezone.now(), state), query),
+            cursor, page_size or settings.POLLS_SEARCH_PAGE_SIZE)
+    return render(request, 'polls/search.html',
+                  index_context(questions, next_cursor, state, page_size,
+                                query))
+
+
+def results_stream(request, pk):
+    """Stream the results of a published question as server-sent events."""
+    if not settings.POLLS_RESULTS_STREAM:
+        raise Http404("Live results are turned off.")
+    question = get_object_or_404(Question.objects.published(timezone.now()),
+                                 pk=pk)
+    if settings.POLLS_ASYNC_VIEWS:
+        events = astream_results(question)
+    else:
+        events = stream_results(question)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def batch_ids(request):
+    """Return the distinct question ids of ?ids=1,2,3, in order.
+
+    Raise BadRequest for ids that are not numbers, or too many of them.
+    """
+    values = [value for param in request.GET.getlist('ids')
+              for value in param.split(',') if value.strip()]
+    if not values:
+        raise BadRequest("Give the question ids as ?ids=1,2,3.")
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except ValueError:
+        raise BadRequest("Question ids must be numbers.")
+    if len(ids) > settings.POLLS_RESULTS_BATCH_MAX_IDS:
+        raise BadRequest(f"At most {settings.POLLS_RESULTS_BATCH_MAX_IDS} "
+                         f"questions per request.")
+    return ids
+
+
+def batch_questions(question_ids, now):
+    """Return the published questions of a batch with what results need.
+
+    Their snapshots are joined in and their choices with tallies are
+    prefetched, so a batch costs two queries.
+    """
+    choices = Prefetch('choice_set', queryset=Choice.objects.for_results())
+    return Question.objects.published(now).filter(
+        id__in=question_ids).select_related(
+            'resultsnapshot').prefetch_related(choices)
+
+
+def batch_results(question_ids, now):
+    """Yield (results, missing ids) of the questions, a chunk at a time.
+
+    Each chunk costs the two queries of batch_questions(). Final questions
+    without a current snapshot take it first. Questions that do not exist
+    or are not published are missing.
+    """
+    chunk_size = settings.POLLS_RESULTS_BATCH_CHUNK
+    for start in range(0, len(question_ids), chunk_size):
+        chunk = question_ids[start:start + chunk_size]
+        questions = batch_questions(chunk, now).in_bulk()
+        results = []
+        missing = []
+        for question_id in chunk:
+            question = questions.get(question_id)
+            if question is None:
+                missing.append(question_id)
+            elif question.is_final(now):
+                try:
+                    snapshot = question.resultsnapshot
+                except ResultSnapshot.DoesNotExist:
+                    snapshot = None
+                if snapshot is None or not snapshot.matches(question):
+                    snapshot = ResultSnapshot.objects.take(question)
+                results.append(results_data(question,
+                                            snapshot.get_results()))
+            else:
+                results.append(results_data(question, add_shares(
+                    list(question.choice_set.all()))))
+        yield results, missing
+
+
+def stream_batch(chunks):
+    """Yield a JSON object of results and missing ids, piece by piece."""
+    encoder = DjangoJSONEncoder()
+    yield '{"results": ['
+    all_missing = []
+    separator = ''
+    for results, missing in chunks:
+        for result in results:
+            yield separator + encoder.encode(result)
+            separator = ', '
+        all_missing.extend(missing)
+    yield f'], "missing": {json.dumps(all_missing)}}}'
+
+
+def results_batch(request):
+    """Return the results of many questions at once as JSON.
+
+    Questions are asked for with ?ids=1,2,3 (or repeated ids=); results
+    come in the order asked, and unknown or unpublished ids are listed
+    under "missing". Long lists are streamed.
+    """
+    question_ids = batch_ids(request)
+    body = stream_batch(batch_results(question_ids, timezone.now()))
+    if len(question_ids) > settings.POLLS_RESULTS_BATCH_CHUNK:
+        response = StreamingHttpResponse(body,
+                                         content_type='application/json')
+    else:
+        response = HttpResponse(''.join(body),
+                                content_type='application/json')
+    patch_cache_control(response, no_cache=True)
+    return response
 
 
 @login_required
 def vote(request, question_id):
     """Vote for voting button."""
     question = get_object_or_404(Question, pk=question_id)
+    state = question.get_state()
+    # results of closed polls are cached as final, and only open polls
+    # take votes
+    if state == CLOSED or (request.method == 'POST' and state != OPEN):
+        messages.error(request, 'This poll is over.' if state == CLOSED
+                       else 'This poll is not open yet.')
+        return HttpResponseRedirect(reverse('polls:index'))
     user = request.user
     try:
         selected_choice = question.choice_set.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
-        return render(request, 'polls/detail.html', {
-            'question': question,
-            'error_message': "You didn't select a choice.",
-        })
+        return render(request, 'polls/detail.html', question_context(
+            question, get_question_version(question.id),
+            choices=question.choice_set.all(),
+            error_message="You didn't select a choice."))
     else:
-        try:
-            current_vote = Vote.objects.get(user=user,
-                                            choice__question=question_id)
-        except Vote.DoesNotExist:
-            current_vote = Vote.objects.create(user=user,
-                                               choice=selected_choice)
-        current_vote.choice = selected_choice
-        current_vote.save()
+        if settings.POLLS_VOTE_BUFFER:
+            get_vote_buffer().add(user.id, question.id, selected_choice.id)
+        else:
+            Vote.objects.cast(user, selected_choice)
         return HttpResponseRedirect(reverse
                                     ('polls:results', args=(question.id,)))
+
+
+@staff_member_required
+def metrics(request):
+    """Report the request metrics and cache hits of this process."""
+    return JsonResponse({
+        'enabled': settings.POLLS_METRICS,
+        'views': registry.summary(),
+        'results_cache': results_stats.as_dict(),
+    })